@@ -6,7 +6,15 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
-from ..construct import Subconstruct, ConstructError, ArrayError
+import struct
+
+from ..construct import (
+    Subconstruct, ConstructError, ArrayError, SizeofError, Construct,
+    FormatField, StaticField, MetaArray, Struct, Buffered, Value, Pass,
+    MappingAdapter, PaddingAdapter, BitIntegerAdapter, MappingError,
+    FieldError, Container, ListContainer,
+    )
+from ..construct.core import _read_stream
 
 
 class RepeatUntilExcluding(Subconstruct):
@@ -43,3 +51,248 @@ class RepeatUntilExcluding(Subconstruct):
     def _sizeof(self, context):
         raise SizeofError("can't calculate size")
 
+
+
+class CompiledStruct(Construct):
+    """ A fixed-size Struct compiled into a single struct.Struct and a pair
+        of generated functions that decode and encode it, producing the
+        same Containers as the Struct.
+
+        Only the constructs with a fixed layout are supported: format fields
+        (UBInt32...), Enum, Padding, nested Structs, Arrays of a fixed count,
+        single-byte BitStructs of unsigned BitFields and Value. Otherwise
+        TypeError is raised.
+
+        Besides the construct interface, parse_from(data, offset) decodes the
+        struct from a string or buffer at an offset.
+    """
+    __slots__ = ['struct', 'packer', 'parse_from', '_encode']
+    def __init__(self, struct):
+        Construct.__init__(self, struct.name)
+        self.struct = struct
+        compiler = _StructCompiler(struct)
+        self.packer = compiler.packer
+        self.parse_from = compiler.decoder
+        self._encode = compiler.encoder
+
+    def parse_stream(self, stream):
+        return self.parse_from(_read_stream(stream, self.packer.size))
+
+    def build(self, obj):
+        return self._encode(obj)
+
+    def build_stream(self, obj, stream):
+        stream.write(self._encode(obj))
+
+    def sizeof(self, context=None):
+        return self.packer.size
+
+    def _parse(self, stream, context):
+        return self.parse_stream(stream)
+
+    def _build(self, obj, stream, context):
+        stream.write(self._encode(obj))
+
+    def _sizeof(self, context):
+        return self.packer.size
+
+
+class _StructCompiler(object):
+    """ Generates the source of the decoding and encoding functions of a
+        CompiledStruct, walking the Struct. The values of the struct.Struct
+        are the fields in order, a byte for each BitStruct.
+    """
+    def __init__(self, con):
+        self.formats = []
+        self.byteorder = None
+        self.namespace = dict(
+            Container=Container, ListContainer=ListContainer,
+            new=Container.__new__, set_attrs=Container.__attrs__.__set__,
+            decode_strict=_decode_strict, encode_strict=_encode_strict,
+            FieldError=FieldError, ArrayError=ArrayError, error=struct.error)
+        self.decode_lines = []
+        self.encode_lines = []
+        self.encode_values = []
+        self.counter = 0
+
+        top = self._add_struct(con, 'obj')
+        self.packer = struct.Struct(
+            (self.byteorder or '=') + ''.join(self.formats))
+        self.namespace['unpack_from'] = self.packer.unpack_from
+        self.namespace['pack'] = self.packer.pack
+
+        source = '\n'.join(
+            ['def decoder(data, offset=0):',
+             '    try:',
+             '        v = unpack_from(data, offset)',
+             '    except error as e:',
+             '        raise FieldError(e)'] +
+            self.decode_lines +
+            ['    return %s' % top,
+             '',
+             'def encoder(obj):'] +
+            self.encode_lines +
+            ['    try:',
+             '        return pack(%s)' % ', '.join(self.encode_values),
+             '    except error as e:',
+             '        raise FieldError(e)'])
+        exec source in self.namespace
+        self.decoder = self.namespace['decoder']
+        self.encoder = self.namespace['encoder']
+
+    def _name(self, prefix, value=None):
+        """ A new variable name of the generated code, bound to value in the
+            namespace if given
+        """
+        self.counter += 1
+        name = '%s%d' % (prefix, self.counter)
+        if value is not None:
+            self.namespace[name] = value
+        return name
+
+    def _add_format(self, fmt):
+        """ Add a struct format (endianness prefix and a character) to the
+            compiled format. Return the index of its value.
+        """
+        if fmt[1] not in 'bBx' and fmt[0] != self.byteorder:
+            if self.byteorder is not None:
+                raise TypeError("can't compile fields of both endianness")
+            self.byteorder = fmt[0]
+        self.formats.append(fmt[1])
+        return len(self.formats) - 1 - self.formats.count('x')
+
+    def _add_struct(self, struct, source):
+        """ Add the fields of a Struct, encoded from the object named source.
+            Return the name of the decoded Container.
+        """
+        container = self._name('c')
+        attrs = []
+        self.decode_lines.append('    %s = new(Container)' % container)
+        for sub in struct.subcons:
+            value = self._add_field(sub, '%s.%s' % (source, sub.name),
+                                    container)
+            if sub.name is not None:
+                attrs.append(sub.name)
+                self.decode_lines.append('    %s.__dict__[%r] = %s' % (
+                    container, sub.name, value))
+        self.decode_lines.append('    set_attrs(%s, %r)' % (container, attrs))
+        return container
+
+    def _add_field(self, con, source, container):
+        """ Add a field of a Struct. Return the expression of its decoded
+            value, None for paddings.
+        """
+        if isinstance(con, FormatField):
+            index = self._add_format(con.packer.format)
+            self.encode_values.append(source)
+            return 'v[%d]' % index
+        elif isinstance(con, MappingAdapter):
+            decoding = self._name('d', con.decoding)
+            encoding = self._name('e', con.encoding)
+            var = self._name('a')
+            self.encode_lines.append('    %s = %s' % (var, source))
+            value = self._add_field(con.subcon, var, container)
+            if con.decdefault is Pass and con.encdefault is Pass:
+                self.encode_lines.append('    %s = %s.get(%s, %s)' % (
+                    var, encoding, var, var))
+                return '%s.get(%s, %s)' % (decoding, value, value)
+            elif (con.decdefault is NotImplemented and
+                  con.encdefault is NotImplemented):
+                self.encode_lines.append('    %s = encode_strict(%s, %s)' % (
+                    var, encoding, var))
+                return 'decode_strict(%s, %s)' % (decoding, value)
+        elif isinstance(con, PaddingAdapter) and not con.strict:
+            if con.pattern == '\x00' and isinstance(con.subcon, StaticField):
+                for _ in xrange(con.subcon.length):
+                    self._add_format('=x')
+                return None
+        elif isinstance(con, Struct) and con.nested:
+            var = self._name('o')
+            self.encode_lines.append('    %s = %s' % (var, source))
+            return self._add_struct(con, var)
+        elif (isinstance(con, MetaArray) and
+              not con._is_flag(con.FLAG_DYNAMIC) and
+              isinstance(con.subcon, FormatField)):
+            count = con.countfunc({})
+            var = self._name('a')
+            self.encode_lines.extend([
+                '    %s = %s' % (var, source),
+                '    if len(%s) != %d:' % (var, count),
+                '        raise ArrayError("expected %d, found %%d" %% len(%s))'
+                    % (count, var)])
+            first = None
+            for i in xrange(count):
+                index = self._add_format(con.subcon.packer.format)
+                first = index if first is None else first
+                self.encode_values.append('%s[%d]' % (var, i))
+            return 'ListContainer(v[%d:%d])' % (first, first + count)
+        elif isinstance(con, Buffered) and isinstance(con.subcon, Struct):
+            return self._add_bitstruct(con.subcon, source)
+        elif isinstance(con, Value):
+            func = self._name('f', con.func)
+            return '%s(%s)' % (func, container)
+        raise TypeError("can't compile %r" % (con,))
+
+    def _add_bitstruct(self, struct, source):
+        """ Add a single byte BitStruct. Return the name of the decoded
+            Container.
+        """
+        index = self._add_format('=B')
+        container = self._name('c')
+        var = self._name('o')
+        self.encode_lines.append('    %s = %s' % (var, source))
+        decode_lines = ['    %s = new(Container)' % container]
+        attrs = []
+        encoded = []
+        bit = 8
+        for sub in struct.subcons:
+            mapping = None
+            if isinstance(sub, MappingAdapter):
+                mapping, sub = sub, sub.subcon
+            if isinstance(sub, PaddingAdapter):
+                bit -= sub.subcon.length
+                continue
+            if (not isinstance(sub, BitIntegerAdapter) or sub.signed or
+                    sub.swapped or not isinstance(sub.subcon, StaticField)):
+                raise TypeError("can't compile %r" % (sub,))
+            bit -= sub.width
+            mask = (1 << sub.width) - 1
+            value = '(v[%d] >> %d) & %d' % (index, bit, mask)
+            field = self._name('a')
+            self.encode_lines.append('    %s = %s.%s' % (field, var, sub.name))
+            if mapping is not None:
+                if mapping.decdefault is not Pass:
+                    raise TypeError("can't compile %r" % (mapping,))
+                decoding = self._name('d', mapping.decoding)
+                encoding = self._name('e', mapping.encoding)
+                value = '%s.get(%s, %s)' % (decoding, value, value)
+                self.encode_lines.append('    %s = %s.get(%s, %s)' % (
+                    field, encoding, field, field))
+            encoded.append('((%s & %d) << %d)' % (field, mask, bit))
+            attrs.append(sub.name)
+            decode_lines.append('    %s.__dict__[%r] = %s' % (
+                container, sub.name, value))
+        if bit != 0:
+            raise TypeError("can't compile %r" % (struct,))
+        decode_lines.append('    set_attrs(%s, %r)' % (container, attrs))
+        self.decode_lines.extend(decode_lines)
+        self.encode_values.append(' | '.join(encoded) or '0')
+        return container
+
+
+def _decode_strict(decoding, obj):
+    """ Decode an Enum value without a default
+    """
+    try:
+        return decoding[obj]
+    except (KeyError, TypeError):
+        raise MappingError("no decoding mapping for %r" % (obj,))
+
+
+def _encode_strict(encoding, obj):
+    """ Encode an Enum value without a default
+    """
+    try:
+        return encoding[obj]
+    except (KeyError, TypeError):
+        raise MappingError("no encoding mapping for %r" % (obj,))
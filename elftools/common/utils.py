@@ -6,6 +6,7 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
+import mmap
 from contextlib import contextmanager
 from .exceptions import ELFParseError, ELFError, DWARFError
 from ..construct import ConstructError
@@ -31,6 +32,16 @@ def struct_parse(struct, stream, stream_pos=None):
         return struct.parse_stream(stream)
     except ConstructError as e:
         raise ELFParseError(e.message)
+
+
+def struct_parse_from(struct, data, offset=0):
+    """ Like struct_parse, for a CompiledStruct: the struct is decoded from
+        data (a string or buffer) at offset.
+    """
+    try:
+        return struct.parse_from(data, offset)
+    except ConstructError as e:
+        raise ELFParseError(e.message)
     
 
 def parse_cstring_from_stream(stream, stream_pos=None):
@@ -60,6 +71,18 @@ def parse_cstring_from_stream(stream, stream_pos=None):
     return ''.join(chunks) if found else None
 
 
+def stream_view(stream, offset, size):
+    """ Return size bytes of the stream, starting at offset.
+        If the stream is a memory mapping, the result is a zero-copy read-only
+        view (buffer) over the mapping. Otherwise the data is read from the
+        stream.
+    """
+    if isinstance(stream, mmap.mmap):
+        return buffer(stream, offset, size)
+    stream.seek(offset)
+    return stream.read(size)
+
+
 def elf_assert(cond, msg=''):
     """ Assert that cond is True, otherwise raise ELFError(msg)
     """
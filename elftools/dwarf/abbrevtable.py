@@ -6,7 +6,11 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
+import struct
+
+from ..common.exceptions import ELFParseError
 from ..common.utils import struct_parse, dwarf_assert
+from .leb128 import read_uleb128
 
 
 class AbbrevTable(object):
@@ -33,23 +37,22 @@ class AbbrevTable(object):
         """ Get the AbbrevDecl for a given code. Raise KeyError if no
             declaration for this code exists.
         """
-        return AbbrevDecl(code, self._abbrev_map[code])
+        return self._abbrev_map[code]
 
     def _parse_abbrev_table(self):
-        """ Parse the abbrev table from the stream
+        """ Parse the abbrev table from the stream. Return a dict mapping
+            codes to AbbrevDecl objects
         """
         map = {}
         self.stream.seek(self.offset)
         while True:
-            decl_code = struct_parse(
-                struct=self.structs.Dwarf_uleb128(''),
-                stream=self.stream)
+            decl_code = read_uleb128(self.stream)
             if decl_code == 0:
                 break
             declaration = struct_parse(
                 struct=self.structs.Dwarf_abbrev_declaration,
                 stream=self.stream)
-            map[decl_code] = declaration
+            map[decl_code] = AbbrevDecl(decl_code, declaration)
         return map
 
 
@@ -62,11 +65,25 @@ class AbbrevDecl(object):
     def __init__(self, code, decl):
         self.code = code
         self.decl = decl
+        self._has_children = self['children_flag'] == 'DW_CHILDREN_yes'
+
+        # AbbrevDecoder objects keyed by FormReader
+        self._decoders = {}
     
     def has_children(self):
         """ Does the entry have children?
         """
-        return self['children_flag'] == 'DW_CHILDREN_yes'
+        return self._has_children
+
+    def get_decoder(self, reader):
+        """ Get the AbbrevDecoder of the entries of this declaration, for the
+            given FormReader. It's compiled on the first request.
+        """
+        decoder = self._decoders.get(reader)
+        if decoder is None:
+            decoder = self._decoders[reader] = AbbrevDecoder(
+                list(self.iter_attr_specs()), reader)
+        return decoder
 
     def iter_attr_specs(self):
         """ Iterate over the attribute specifications for the entry. Yield
@@ -78,3 +95,133 @@ class AbbrevDecl(object):
     def __getitem__(self, entry):
         return self.decl[entry]
 
+
+class AbbrevDecoder(object):
+    """ A decoder plan for the attribute values of the entries of an
+        abbreviation declaration, compiled for a FormReader. Runs of
+        consecutive fixed-size forms are fused into a single struct format,
+        so their values are decoded together and skipped over at once.
+
+        attr_specs:
+            The (name, form) pairs of the attributes
+
+        attr_indexes:
+            The indexes of the attributes in attr_specs, keyed by name
+
+        fixed_size:
+            The total size of the attribute values when all the forms are
+            fixed-size, otherwise None. Entries of such declarations are
+            skipped without looking at their data.
+    """
+    def __init__(self, attr_specs, reader):
+        self.attr_specs = attr_specs
+        self.attr_indexes = dict(
+            (name, i) for i, (name, form) in enumerate(attr_specs))
+        self.reader = reader
+
+        # The plan: for each run of fixed-size forms, the tuple
+        # (struct.Struct of the run, offsets of the values in the run), and
+        # for the other forms the tuple (None, form)
+        self._steps = []
+        run_formats = []
+        run_offsets = []
+        run_size = 0
+        for name, form in attr_specs:
+            value_struct = reader.fixed_forms.get(form)
+            if value_struct is not None:
+                # The formats are a byte order followed by a single field,
+                # with standard sizes and no alignment
+                byteorder = value_struct.format[0]
+                run_formats.append(value_struct.format[1:])
+                run_offsets.append(run_size)
+                run_size += value_struct.size
+                continue
+            if run_formats:
+                self._add_run(byteorder, run_formats, run_offsets)
+                run_formats, run_offsets, run_size = [], [], 0
+            self._steps.append((None, form))
+        if run_formats:
+            self._add_run(byteorder, run_formats, run_offsets)
+
+        self.fixed_size = None
+        if not self._steps:
+            self.fixed_size = 0
+        elif len(self._steps) == 1 and self._steps[0][0] is not None:
+            self.fixed_size = self._steps[0][0].size
+
+    def skip(self, data, offset):
+        """ Return the offset right after the attribute values of an entry,
+            which begin at offset of data
+        """
+        if self.fixed_size is not None:
+            return offset + self.fixed_size
+        skip = self.reader.skip
+        for run_struct, form in self._steps:
+            if run_struct is not None:
+                offset += run_struct.size
+            else:
+                offset = skip(data, offset, form)
+        return offset
+
+    def attr_offsets(self, data, offset):
+        """ The offsets of the attribute values of an entry, which begin at
+            offset of data. Return the tuple (list of offsets, offset right
+            after the values)
+        """
+        offsets = []
+        skip = self.reader.skip
+        for run_struct, step in self._steps:
+            if run_struct is not None:
+                offsets.extend([offset + value_offset for value_offset in step])
+                offset += run_struct.size
+            else:
+                offsets.append(offset)
+                offset = skip(data, offset, step)
+        return offsets, offset
+
+    def attr_offset(self, data, offset, index):
+        """ The offset of the value of the attribute at index of attr_specs,
+            for an entry whose attribute values begin at offset of data. Only
+            the values before it are skipped over.
+        """
+        i = 0
+        skip = self.reader.skip
+        for run_struct, step in self._steps:
+            if run_struct is not None:
+                if index < i + len(step):
+                    return offset + step[index - i]
+                i += len(step)
+                offset += run_struct.size
+            else:
+                if index == i:
+                    return offset
+                i += 1
+                offset = skip(data, offset, step)
+        raise IndexError(index)
+
+    def decode(self, data, offset):
+        """ Decode the raw values of the attributes of an entry, which begin
+            at offset of data. Return a list with a raw value per attribute.
+        """
+        values = []
+        read = self.reader.read
+        for run_struct, step in self._steps:
+            if run_struct is not None:
+                try:
+                    values.extend(run_struct.unpack_from(data, offset))
+                except struct.error:
+                    raise ELFParseError(
+                        'Truncated attribute values at offset %s' % offset)
+                offset += run_struct.size
+            else:
+                value, end = read(data, offset, step)
+                if step == 'DW_FORM_indirect':
+                    # The value of the actual form follows its code
+                    end = self.reader.skip(data, offset, step)
+                values.append(value)
+                offset = end
+        return values
+
+    def _add_run(self, byteorder, formats, offsets):
+        self._steps.append(
+            (struct.Struct(byteorder + ''.join(formats)), tuple(offsets)))
@@ -7,9 +7,12 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 import copy
+import struct
 from collections import namedtuple
+from ..common.exceptions import ELFParseError
 from ..common.utils import (struct_parse, dwarf_assert, preserve_stream_pos)
 from .structs import DWARFStructs
+from .leb128 import decode_uleb128, decode_sleb128, decode_uleb128_list
 from .constants import * 
 
 
@@ -126,9 +129,33 @@ class CallFrameInfo(object):
             the offset and until (not including) end_offset.
             Return a list of CallFrameInstruction objects.
         """
+        # The instructions are read once, and decoded from the string
+        self.stream.seek(offset)
+        data = self.stream.read(end_offset - offset)
+        start_offset = offset
+        byteorder = '<' if structs.little_endian else '>'
+        uint_structs = dict(
+            (size, struct.Struct(byteorder + fmt))
+            for size, fmt in ((1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q')))
+        target_addr_struct = uint_structs[structs.address_size]
+
+        def unpack(value_struct):
+            if offset + value_struct.size > len(data):
+                raise ELFParseError('Truncated CFI instruction')
+            return value_struct.unpack_from(data, offset)[0]
+
+        def block():
+            length, block_offset = decode_uleb128(data, offset)
+            if block_offset + length > len(data):
+                raise ELFParseError('Truncated CFI instruction')
+            return (map(ord, data[block_offset:block_offset + length]),
+                    block_offset + length)
+
         instructions = []
-        while offset < end_offset:
-            opcode = struct_parse(structs.Dwarf_uint8(''), self.stream, offset)
+        offset = 0
+        while offset < len(data):
+            opcode = ord(data[offset])
+            offset += 1
             args = []
 
             primary = opcode & _PRIMARY_MASK
@@ -136,9 +163,8 @@ class CallFrameInfo(object):
             if primary == DW_CFA_advance_loc:
                 args = [primary_arg]
             elif primary == DW_CFA_offset:
-                args = [
-                    primary_arg,
-                    struct_parse(structs.Dwarf_uleb128(''), self.stream)]
+                arg, offset = decode_uleb128(data, offset)
+                args = [primary_arg, arg]
             elif primary == DW_CFA_restore:
                 args = [primary_arg]
             # primary == 0 and real opcode is extended
@@ -146,43 +172,40 @@ class CallFrameInfo(object):
                             DW_CFA_restore_state):
                 args = []
             elif opcode == DW_CFA_set_loc:
-                args = [
-                    struct_parse(structs.Dwarf_target_addr(''), self.stream)]
-            elif opcode == DW_CFA_advance_loc1:
-                args = [struct_parse(structs.Dwarf_uint8(''), self.stream)]
-            elif opcode == DW_CFA_advance_loc2:
-                args = [struct_parse(structs.Dwarf_uint16(''), self.stream)]
-            elif opcode == DW_CFA_advance_loc4:
-                args = [struct_parse(structs.Dwarf_uint32(''), self.stream)]
+                args = [unpack(target_addr_struct)]
+                offset += target_addr_struct.size
+            elif opcode in _ADVANCE_LOC_SIZES:
+                value_struct = uint_structs[_ADVANCE_LOC_SIZES[opcode]]
+                args = [unpack(value_struct)]
+                offset += value_struct.size
             elif opcode in (DW_CFA_offset_extended, DW_CFA_register,
                             DW_CFA_def_cfa, DW_CFA_val_offset):
-                args = [
-                    struct_parse(structs.Dwarf_uleb128(''), self.stream),
-                    struct_parse(structs.Dwarf_uleb128(''), self.stream)]
+                args, offset = decode_uleb128_list(data, offset, 2)
             elif opcode in (DW_CFA_restore_extended, DW_CFA_undefined,
                             DW_CFA_same_value, DW_CFA_def_cfa_register,
                             DW_CFA_def_cfa_offset):
-                args = [struct_parse(structs.Dwarf_uleb128(''), self.stream)]
+                arg, offset = decode_uleb128(data, offset)
+                args = [arg]
             elif opcode == DW_CFA_def_cfa_offset_sf:
-                args = [struct_parse(structs.Dwarf_sleb128(''), self.stream)]
+                arg, offset = decode_sleb128(data, offset)
+                args = [arg]
             elif opcode == DW_CFA_def_cfa_expression:
-                args = [struct_parse(
-                    structs.Dwarf_dw_form['DW_FORM_block'], self.stream)]
+                arg, offset = block()
+                args = [arg]
             elif opcode in (DW_CFA_expression, DW_CFA_val_expression):
-                args = [
-                    struct_parse(structs.Dwarf_uleb128(''), self.stream),
-                    struct_parse(
-                        structs.Dwarf_dw_form['DW_FORM_block'], self.stream)]
+                reg, offset = decode_uleb128(data, offset)
+                arg, offset = block()
+                args = [reg, arg]
             elif opcode in (DW_CFA_offset_extended_sf,
                             DW_CFA_def_cfa_sf, DW_CFA_val_offset_sf):
-                args = [
-                    struct_parse(structs.Dwarf_uleb128(''), self.stream),
-                    struct_parse(structs.Dwarf_sleb128(''), self.stream)]
+                reg, offset = decode_uleb128(data, offset)
+                arg, offset = decode_sleb128(data, offset)
+                args = [reg, arg]
             else:
                 dwarf_assert(False, 'Unknown CFI opcode: 0x%x' % opcode)
 
             instructions.append(CallFrameInstruction(opcode=opcode, args=args))
-            offset = self.stream.tell()
+        self.stream.seek(start_offset + offset)
         return instructions
 
 
@@ -430,6 +453,13 @@ DecodedCallFrameTable = namedtuple(
 _PRIMARY_MASK = 0b11000000
 _PRIMARY_ARG_MASK = 0b00111111
 
+# Size of the operand of the DW_CFA_advance_loc<n> instructions
+_ADVANCE_LOC_SIZES = {
+    DW_CFA_advance_loc1: 1,
+    DW_CFA_advance_loc2: 2,
+    DW_CFA_advance_loc4: 4,
+}
+
 # This dictionary is filled by automatically scanning the constants module
 # for DW_CFA_* instructions, and mapping their values to names. Since all
 # names were imported from constants with `import *`, we look in globals()
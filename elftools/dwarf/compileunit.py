@@ -7,6 +7,15 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 from .die import DIE
+from .forms import FormReader
+from .leb128 import decode_uleb128
+
+
+# The forms of DW_AT_sibling references relative to the CU. DW_FORM_ref_addr
+# is relative to the section.
+_CU_REF_FORMS = frozenset((
+    'DW_FORM_ref1', 'DW_FORM_ref2', 'DW_FORM_ref4', 'DW_FORM_ref8',
+    'DW_FORM_ref_udata'))
 
 
 class CompileUnit(object):
@@ -26,6 +35,11 @@ class CompileUnit(object):
         
         To get the top-level DIE describing the compilation unit, call the 
         get_top_DIE method.
+
+        iter_DIE_children and walk go over parts of the DIE tree without
+        parsing the subtrees they skip: they jump over them with the
+        DW_AT_sibling attribute when it's present, or else skip over their
+        entries with the decoders of the abbreviation declarations.
     """
     def __init__(self, header, dwarfinfo, structs, cu_offset, cu_die_offset):
         """ header:
@@ -55,6 +69,12 @@ class CompileUnit(object):
         
         # A list of DIEs belonging to this CU. Lazily parsed.
         self._dielist = []
+
+        # The top DIE, parsed alone when it's requested before the others
+        self._top_DIE = None
+
+        # The FormReader for the attribute values of the DIEs
+        self._form_reader = FormReader.for_structs(structs)
     
     def dwarf_format(self):
         """ Get the DWARF format (32 or 64) for this CU
@@ -69,19 +89,145 @@ class CompileUnit(object):
                 self['debug_abbrev_offset'])
         return self._abbrev_table
 
+    def get_form_reader(self):
+        """ Get the FormReader skipping over and decoding the attribute values
+            of the DIEs of this CU
+        """
+        return self._form_reader
+
     def get_top_DIE(self):
         """ Get the top DIE (which is either a DW_TAG_compile_unit or 
-            DW_TAG_partial_unit) of this CU
+            DW_TAG_partial_unit) of this CU. Only this DIE is parsed if the
+            others weren't already.
         """
-        return self._get_DIE(0)
+        if self._top_DIE is None:
+            if self._dielist:
+                self._top_DIE = self._dielist[0]
+            else:
+                self._top_DIE = self._parse_DIE_at(self.cu_die_offset)
+                self._top_DIE.depth = 0
+        return self._top_DIE
     
-    def iter_DIEs(self):
+    def iter_DIEs(self, lazy=False):
         """ Iterate over all the DIEs in the CU, in order of their appearance.
             Note that null DIEs will also be returned.
+
+            If lazy is True and the DIEs weren't parsed already, they're
+            parsed as they're iterated and not kept by the CU: each DIE
+            is linked to its parent (get_parent), but not to its children,
+            so only the chain of parents of the current DIE is kept alive.
+            The depth attribute of the DIEs gives their place in the tree.
         """
+        if lazy and not self._dielist:
+            return self._iter_DIEs_lazy()
         self._parse_DIEs()
         return iter(self._dielist)
     
+    def iter_DIE_children(self, die):
+        """ Yield the children of die (a DIE of this CU), parsing only the
+            children themselves: their subtrees are skipped over. The
+            children are linked to die as their parent.
+        """
+        if not die.has_children:
+            return
+        cu_boundary = self._cu_boundary()
+        die_offset = die.offset + die.size
+        while die_offset < cu_boundary:
+            child = self._parse_DIE_at(die_offset)
+            if child.is_null():
+                break
+            child.set_parent(die)
+            if die.depth is not None:
+                child.depth = die.depth + 1
+            yield child
+            die_offset = self._skip_subtree(child)
+
+    def walk(self, prune=None):
+        """ Yield the DIEs of the CU in order of their appearance, like
+            iter_DIEs(lazy=True) but without the null DIEs.
+
+            prune, if given, is called with each DIE having children after
+            it's yielded: when it returns True, the subtree of the DIE is
+            skipped over without being parsed.
+        """
+        cu_boundary = self._cu_boundary()
+        # The chain of parents of the current DIE
+        parentstack = []
+        die_offset = self.cu_die_offset
+        while die_offset < cu_boundary:
+            die = self._parse_DIE_at(die_offset)
+            if die.is_null():
+                if parentstack:
+                    # end of children for the current parent
+                    parentstack.pop()
+                die_offset += die.size
+                continue
+            die.depth = len(parentstack)
+            if parentstack:
+                die.set_parent(parentstack[-1])
+            yield die
+            if not die.has_children:
+                die_offset += die.size
+            elif prune is not None and prune(die):
+                die_offset = self._skip_subtree(die)
+            else:
+                parentstack.append(die)
+                die_offset += die.size
+
+    def scan(self, tags=None, attrs=None):
+        """ Yield the DIEs of the CU having one of the given tags (DW_TAG_*
+            names) and at least one of the given attributes (DW_AT_* names),
+            in order of their appearance. Pass None to not filter on tags or
+            attributes.
+
+            Whether a DIE can match is decided from its abbreviation
+            declaration alone, so only the matching DIEs are parsed: the
+            other entries are skipped over by their size. The DIEs yielded
+            have their depth set but aren't linked to their parents, and
+            their attribute values are decoded on access as usual.
+        """
+        if tags is not None:
+            tags = frozenset(tags)
+        if attrs is not None:
+            attrs = frozenset(attrs)
+        data = self.dwarfinfo.debug_info_sec.data
+        abbrev_table = self.get_abbrev_table()
+        reader = self._form_reader
+        cu_boundary = self._cu_boundary()
+
+        # The tuple (matches, decoder, has children) for each abbreviation
+        # declaration, keyed by code
+        abbrev_plans = {}
+        depth = 0
+        offset = self.cu_die_offset
+        while offset < cu_boundary:
+            die_offset = offset
+            abbrev_code, offset = decode_uleb128(data, offset)
+            if abbrev_code == 0:
+                # end of children for the current parent
+                depth = max(depth - 1, 0)
+                continue
+            plan = abbrev_plans.get(abbrev_code)
+            if plan is None:
+                abbrev_decl = abbrev_table.get_abbrev(abbrev_code)
+                decoder = abbrev_decl.get_decoder(reader)
+                plan = abbrev_plans[abbrev_code] = (
+                    (tags is None or abbrev_decl['tag'] in tags) and
+                    (attrs is None or
+                     not attrs.isdisjoint(decoder.attr_indexes)),
+                    decoder,
+                    abbrev_decl.has_children())
+            matches, decoder, has_children = plan
+            if matches:
+                die = self._parse_DIE_at(die_offset)
+                die.depth = depth
+                yield die
+                offset = die_offset + die.size
+            else:
+                offset = decoder.skip(data, offset)
+            if has_children:
+                depth += 1
+
     #------ PRIVATE ------#
     
     def __getitem__(self, name):
@@ -94,7 +240,88 @@ class CompileUnit(object):
         """
         self._parse_DIEs()
         return self._dielist[index]
+
+    def _parse_DIE_at(self, offset):
+        """ Parse the DIE at the given offset of the stream
+        """
+        return DIE(
+                cu=self,
+                stream=self.dwarfinfo.debug_info_sec.stream,
+                offset=offset)
+
+    def _cu_boundary(self):
+        """ The boundary (one byte past the bounds) of this CU in the stream
+        """
+        return (self.cu_offset +
+                self['unit_length'] +
+                self.structs.initial_length_field_size())
     
+    def _skip_subtree(self, die):
+        """ The offset right after the subtree of die (its entry, children
+            and the null entry ending them) in the stream
+        """
+        die_end = die.offset + die.size
+        if not die.has_children:
+            return die_end
+        if 'DW_AT_sibling' in die.attributes:
+            sibling = die.attributes['DW_AT_sibling']
+            sibling_offset = self._sibling_offset(
+                sibling.form, sibling.raw_value, die_end)
+            if sibling_offset is not None:
+                return sibling_offset
+        return self._skip_entries(die_end)
+
+    def _skip_entries(self, offset):
+        """ Skip over the entries beginning at offset, up to the null entry
+            ending them (that of the parent of the first entry). Return the
+            offset right after it. No DIE is created: the entries are skipped
+            with the decoders of their abbreviation declarations, and
+            subtrees jumped over with DW_AT_sibling when it's present.
+        """
+        data = self.dwarfinfo.debug_info_sec.data
+        abbrev_table = self.get_abbrev_table()
+        reader = self._form_reader
+        cu_boundary = self._cu_boundary()
+        depth = 1
+        while depth and offset < cu_boundary:
+            abbrev_code, offset = decode_uleb128(data, offset)
+            if abbrev_code == 0:
+                depth -= 1
+                continue
+            abbrev_decl = abbrev_table.get_abbrev(abbrev_code)
+            decoder = abbrev_decl.get_decoder(reader)
+            values_offset = offset
+            offset = decoder.skip(data, offset)
+            if not abbrev_decl.has_children():
+                continue
+            index = decoder.attr_indexes.get('DW_AT_sibling')
+            if index is not None:
+                form = decoder.attr_specs[index][1]
+                raw_value, _ = reader.read(
+                    data, decoder.attr_offset(data, values_offset, index),
+                    form)
+                sibling_offset = self._sibling_offset(form, raw_value, offset)
+                if sibling_offset is not None:
+                    offset = sibling_offset
+                    continue
+            depth += 1
+        return offset
+
+    def _sibling_offset(self, form, raw_value, children_offset):
+        """ The offset in the stream of a DW_AT_sibling reference, of a DIE
+            whose children begin at children_offset. None if the reference
+            can't be followed (it doesn't point past the children, in the CU)
+        """
+        if form in _CU_REF_FORMS:
+            sibling_offset = self.cu_offset + raw_value
+        elif form == 'DW_FORM_ref_addr':
+            sibling_offset = raw_value
+        else:
+            return None
+        if children_offset < sibling_offset <= self._cu_boundary():
+            return sibling_offset
+        return None
+
     def _parse_DIEs(self):
         """ Parse all the DIEs pertaining to this CU from the stream and shove
             them sequentially into self._dielist.
@@ -104,24 +331,45 @@ class CompileUnit(object):
         if len(self._dielist) > 0:
             return
             
-        # Compute the boundary (one byte past the bounds) of this CU in the 
-        # stream
-        cu_boundary = ( self.cu_offset + 
-                        self['unit_length'] + 
-                        self.structs.initial_length_field_size())
+        cu_boundary = self._cu_boundary()
         
-        # First pass: parse all DIEs and place them into self._dielist
-        die_offset = self.cu_die_offset
+        # First pass: parse all DIEs and place them into self._dielist.
+        # The top DIE may already be parsed.
+        top_DIE = self.get_top_DIE()
+        self._dielist.append(top_DIE)
+        die_offset = top_DIE.offset + top_DIE.size
         while die_offset < cu_boundary:
-            die = DIE(
-                    cu=self,
-                    stream=self.dwarfinfo.debug_info_sec.stream,
-                    offset=die_offset)
+            die = self._parse_DIE_at(die_offset)
             self._dielist.append(die)
             die_offset += die.size
 
         # Second pass - unflatten the DIE tree
         self._unflatten_tree()
+
+    def _iter_DIEs_lazy(self):
+        """ Parse the DIEs of this CU one by one and yield them, setting their
+            parent link and depth, but not keeping them
+        """
+        cu_boundary = self._cu_boundary()
+        top_DIE = self.get_top_DIE()
+        yield top_DIE
+
+        # The chain of parents of the current DIE
+        parentstack = [top_DIE] if top_DIE.has_children else []
+        die_offset = top_DIE.offset + top_DIE.size
+        while die_offset < cu_boundary:
+            die = self._parse_DIE_at(die_offset)
+            die.depth = len(parentstack)
+            if not die.is_null():
+                if parentstack:
+                    die.set_parent(parentstack[-1])
+                if die.has_children:
+                    parentstack.append(die)
+            elif parentstack:
+                # end of children for the current parent
+                parentstack.pop()
+            die_offset += die.size
+            yield die
     
     def _unflatten_tree(self):
         """ "Unflatten" the DIE tree from it serial representation, by setting
@@ -132,9 +380,11 @@ class CompileUnit(object):
         """
         # the first DIE in the list is the root node
         root = self._dielist[0]
+        root.depth = 0
         parentstack = [root]
         
         for die in self._dielist[1:]:
+            die.depth = len(parentstack)
             if not die.is_null():
                 cur_parent = parentstack[-1]
                 # This DIE is a child of the current parent
@@ -145,4 +395,3 @@ class CompileUnit(object):
             else:
                 # end of children for the current parent
                 parentstack.pop()
-
@@ -6,10 +6,10 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
-from collections import namedtuple
+from collections import namedtuple, MutableMapping
 
-from ..common.ordereddict import OrderedDict
-from ..common.utils import struct_parse, preserve_stream_pos
+from ..common.exceptions import ELFParseError
+from .leb128 import decode_uleb128
 
 
 # AttributeValue - describes an attribute value in the DIE: 
@@ -53,10 +53,16 @@ class DIE(object):
             
             attributes:
                 An ordered dictionary mapping attribute names to values. It's 
-                ordered to preserve the order of attributes in the section
+                ordered to preserve the order of attributes in the section.
+                Each value is decoded on its first access (see
+                decode_attributes)
             
             has_children:
                 Specifies whether this DIE has children
+
+            depth:
+                The depth of this DIE in the DIE tree of its CU (0 for the
+                top DIE), set by the CU
             
             abbrev_code:
                 The abbreviation code pointing to an abbreviation entry (not
@@ -78,15 +84,21 @@ class DIE(object):
         self.stream = stream
         self.offset = offset
         
-        self.attributes = OrderedDict()
         self.tag = None
         self.has_children = None
         self.abbrev_code = None
         self.size = 0
+        self.depth = None
         self._children = []
         self._parent = None
+
+        # The AbbrevDecoder of the attribute values, and their offset in the
+        # section
+        self._decoder = None
+        self._values_offset = None
         
-        self._parse_DIE()   
+        self._parse_DIE()
+        self.attributes = _LazyAttributes(self)
     
     def is_null(self):
         """ Is this a null entry?
@@ -114,6 +126,13 @@ class DIE(object):
         else:
             raise StopIteration()
 
+    def decode_attributes(self):
+        """ Decode all the attribute values of this DIE now, instead of on
+            their first access. Return the attributes
+        """
+        self.attributes.decode_all()
+        return self.attributes
+
     # The following methods are used while creating the DIE and should not be
     # interesting to consumers
     #
@@ -137,63 +156,171 @@ class DIE(object):
     
     def _parse_DIE(self):
         """ Parses the DIE info from the section, based on the abbreviation
-            table of the CU
+            table of the CU. The attribute values are only skipped over, with
+            the decoder of the abbreviation declaration: they are decoded by
+            _decode_attr when accessed.
         """
-        structs = self.cu.structs
+        data = self.dwarfinfo.debug_info_sec.data
         
         # A DIE begins with the abbreviation code. Read it and use it to 
         # obtain the abbrev declaration for this DIE.
-        # Note: here and elsewhere, preserve_stream_pos is used on operations
-        # that manipulate the stream by reading data from it.
         #
-        self.abbrev_code = struct_parse(
-            structs.Dwarf_uleb128(''), self.stream, self.offset)
+        self.abbrev_code, offset = decode_uleb128(data, self.offset)
         
         # This may be a null entry
         if self.abbrev_code == 0:
-            self.size = self.stream.tell() - self.offset
+            self.size = offset - self.offset
             return
         
-        with preserve_stream_pos(self.stream):
-            abbrev_decl = self.cu.get_abbrev_table().get_abbrev(
-                self.abbrev_code)
+        abbrev_decl = self.cu.get_abbrev_table().get_abbrev(self.abbrev_code)
         self.tag = abbrev_decl['tag']
         self.has_children = abbrev_decl.has_children()
 
-        # Guided by the attributes listed in the abbreviation declaration, parse
-        # values from the stream.
+        # Guided by the attributes listed in the abbreviation declaration, skip
+        # over the values in the section. When all their forms are fixed-size
+        # the data isn't even looked at.
         #
-        for name, form in abbrev_decl.iter_attr_specs():
-            attr_offset = self.stream.tell()
-            raw_value = struct_parse(structs.Dwarf_dw_form[form], self.stream)
+        self._decoder = abbrev_decl.get_decoder(self.cu.get_form_reader())
+        self._values_offset = offset
+        offset = self._decoder.skip(data, offset)
+        if offset > len(data):
+            raise ELFParseError('DIE at offset %s is truncated' % self.offset)
+
+        self.size = offset - self.offset
+
+    def _get_attr_specs(self):
+        """ The (name, form, offset) of the attribute values, in the section
+            order
+        """
+        if self._decoder is None:
+            return []
+        offsets, _ = self._decoder.attr_offsets(
+            self.dwarfinfo.debug_info_sec.data, self._values_offset)
+        return [(name, form, offset) for (name, form), offset
+                in zip(self._decoder.attr_specs, offsets)]
 
-            value = self._translate_attr_value(form, raw_value)            
-            self.attributes[name] = AttributeValue(
+    def _decode_attrs(self):
+        """ Decode the AttributeValue of all the attributes, in the section
+            order, going over the values once
+        """
+        if self._decoder is None:
+            return []
+        raw_values = self._decoder.decode(
+            self.dwarfinfo.debug_info_sec.data, self._values_offset)
+        attr_values = []
+        for (name, form, offset), raw_value in zip(
+                self._get_attr_specs(), raw_values):
+            if form == 'DW_FORM_indirect':
+                attr_values.append(self._decode_attr(name, form, offset))
+                continue
+            attr_values.append(AttributeValue(
                 name=name,
                 form=form,
-                value=value,
+                value=self._translate_attr_value(form, raw_value, None),
                 raw_value=raw_value,
-                offset=attr_offset)
-        
-        self.size = self.stream.tell() - self.offset
+                offset=offset))
+        return attr_values
+
+    def _decode_attr(self, name, form, offset):
+        """ Decode the AttributeValue of the attribute whose value is at
+            offset of the section
+        """
+        raw_value, value_end = self.cu.get_form_reader().read(
+            self.dwarfinfo.debug_info_sec.data, offset, form)
+        return AttributeValue(
+            name=name,
+            form=form,
+            value=self._translate_attr_value(form, raw_value, value_end),
+            raw_value=raw_value,
+            offset=offset)
 
-    def _translate_attr_value(self, form, raw_value):
-        """ Translate a raw attr value according to the form
+    def _translate_attr_value(self, form, raw_value, value_end):
+        """ Translate a raw attr value according to the form. value_end is
+            the offset right after the raw value in the section
         """
         value = None
         if form == 'DW_FORM_strp':
-            with preserve_stream_pos(self.stream):
-                value = self.dwarfinfo.get_string_from_table(raw_value)
+            value = self.dwarfinfo.get_string_from_table(raw_value)
         elif form == 'DW_FORM_flag':
             value = not raw_value == 0
         elif form == 'DW_FORM_indirect':
-            form = raw_value
-            raw_value = struct_parse(
-                structs.Dwarf_dw_form[form], self.stream)
+            # The raw value is the code of the actual form, whose value follows
+            reader = self.cu.get_form_reader()
+            form = reader.indirect_form(raw_value)
+            raw_value, value_end = reader.read(
+                self.dwarfinfo.debug_info_sec.data, value_end, form)
             # Let's hope this doesn't get too deep :-)
-            return self._translate_attr_value(form, raw_value)
+            return self._translate_attr_value(form, raw_value, value_end)
         else:
             value = raw_value
         return value
-    
 
+
+class _LazyAttributes(MutableMapping):
+    """ The attributes of a DIE: an ordered mapping of attribute names to
+        AttributeValue, used like an OrderedDict. The offsets of the values
+        are found on the first use, and each value is decoded on its first
+        access.
+    """
+    def __init__(self, die):
+        self._die = die
+        # (name, form, offset) of each attribute, in order
+        self._specs = None
+        # The decoded values, keyed by name
+        self._values = {}
+
+    @property
+    def _attr_specs(self):
+        if self._specs is None:
+            self._specs = self._die._get_attr_specs()
+        return self._specs
+
+    def decode_all(self):
+        """ Decode the values of all the attributes that weren't accessed
+        """
+        if len(self._values) == len(self._attr_specs):
+            return
+        names = set(self)
+        for attr_value in self._die._decode_attrs():
+            if attr_value.name in names:
+                self._values.setdefault(attr_value.name, attr_value)
+
+    def __getitem__(self, name):
+        # Values may be set to anything, None included
+        if name in self._values:
+            return self._values[name]
+        for spec in self._attr_specs:
+            if spec[0] == name:
+                break
+        else:
+            raise KeyError(name)
+        value = self._values[name] = self._die._decode_attr(*spec)
+        return value
+
+    def __setitem__(self, name, value):
+        if name not in self:
+            self._attr_specs.append((name, None, None))
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._attr_specs[:] = [
+            spec for spec in self._attr_specs if spec[0] != name]
+        self._values.pop(name, None)
+
+    def __contains__(self, name):
+        for spec in self._attr_specs:
+            if spec[0] == name:
+                return True
+        return False
+
+    def __iter__(self):
+        for spec in self._attr_specs:
+            yield spec[0]
+
+    def __len__(self):
+        return len(self._attr_specs)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.items())
@@ -7,6 +7,7 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 from collections import namedtuple
+from cStringIO import StringIO
 
 from ..common.exceptions import DWARFError
 from ..common.utils import (struct_parse, dwarf_assert,
@@ -30,8 +31,78 @@ from .ranges import RangeLists
 # 'name' and 'global_offset' are for descriptional purposes only and
 # aren't strictly required for the DWARF parsing to work.
 #
-DebugSectionDescriptor = namedtuple('DebugSectionDescriptor', 
-    'stream name global_offset size')
+class DebugSectionDescriptor(namedtuple('DebugSectionDescriptor',
+        'stream name global_offset size')):
+    """ The namedtuple describing a debug section, see above.
+
+        A loader (a callable returning the data of the section, a string or
+        a buffer) can be given instead of the stream. The stream is then a
+        stand-in that calls the loader on its first use, so sections that
+        aren't used are never read.
+    """
+    def __new__(cls, stream, name, global_offset, size, loader=None):
+        if loader is not None:
+            stream = _LazySectionStream(loader)
+        return super(DebugSectionDescriptor, cls).__new__(
+            cls, stream, name, global_offset, size)
+
+    # The contents of the section, read by the data property
+    _data = None
+
+    @property
+    def data(self):
+        """ The contents of the section as a string, for the parts of the
+            DWARF reader that decode straight from it. Read on first access
+        """
+        if self._data is None:
+            if isinstance(self.stream, _LazySectionStream):
+                data = self.stream.get_data()
+            else:
+                self.stream.seek(0)
+                data = self.stream.read(self.size)
+            if not isinstance(data, str):
+                # A buffer over a memory-mapped file
+                data = str(data)
+            self._data = data
+        return self._data
+
+    def is_loaded(self):
+        """ Whether the data of the section was read already
+        """
+        return (not isinstance(self.stream, _LazySectionStream) or
+                self.stream.is_loaded())
+
+
+class _LazySectionStream(object):
+    """ Stands for the stream of a section until it's used: the data of the
+        section is then read by the loader, and the attributes of a stream
+        over it are returned (and kept, so they're looked up only once).
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._data = None
+        self._stream = None
+
+    def is_loaded(self):
+        return self._stream is not None
+
+    def get_data(self):
+        """ The data returned by the loader
+        """
+        self._load()
+        return self._data
+
+    def _load(self):
+        if self._stream is None:
+            self._data = self._loader()
+            self._stream = StringIO(self._data)
+            self._loader = None
+
+    def __getattr__(self, name):
+        self._load()
+        value = getattr(self._stream, name)
+        setattr(self, name, value)
+        return value
 
 
 # Some configuration parameters for the DWARF reader. This exists to allow
@@ -96,6 +167,16 @@ class DWARFInfo(object):
         """
         return self._parse_CUs_iter()
 
+    def scan(self, tags=None, attrs=None):
+        """ Yield the DIEs of all the CUs having one of the given tags
+            (DW_TAG_* names) and at least one of the given attributes
+            (DW_AT_* names). Pass None to not filter on tags or attributes.
+            See CompileUnit.scan
+        """
+        for cu in self.iter_CUs():
+            for die in cu.scan(tags, attrs):
+                yield die
+
     def get_abbrev_table(self, offset):
         """ Get an AbbrevTable from the given offset in the debug_abbrev
             section.
@@ -0,0 +1,132 @@
+#-------------------------------------------------------------------------------
+# elftools: dwarf/forms.py
+#
+# Skipping over and decoding attribute values by their form (DW_FORM_*)
+# straight from the data of a section, without going through construct
+#
+# Davi Costa (davialcosta@gmail.com)
+# This code is in the public domain
+#-------------------------------------------------------------------------------
+import struct
+
+from ..common.exceptions import ELFParseError
+from ..construct import FormatField, ListContainer
+from .enums import ENUM_DW_FORM
+from .leb128 import decode_uleb128, decode_sleb128
+
+
+# Form names keyed by their code, for DW_FORM_indirect
+_FORM_NAMES = dict((code, name) for name, code in ENUM_DW_FORM.iteritems())
+
+
+class FormReader(object):
+    """ Skips over and decodes attribute values in the data (a string) of a
+        section, for the DWARF format, address size and endianness of a
+        DWARFStructs. The raw values are the same as parsing
+        structs.Dwarf_dw_form[form] from a stream: fixed-size forms are
+        decoded with the formats of the fields of structs.
+
+        Readers are shared by the structs with the same parameters, use
+        FormReader.for_structs to get one.
+    """
+    # FormReader objects keyed by (little_endian, dwarf_format, address_size)
+    _readers = {}
+
+    @classmethod
+    def for_structs(cls, structs):
+        """ The FormReader for the parameters of structs (DWARFStructs)
+        """
+        key = (structs.little_endian, structs.dwarf_format,
+               structs.address_size)
+        reader = cls._readers.get(key)
+        if reader is None:
+            reader = cls._readers[key] = cls(structs)
+        return reader
+
+    def __init__(self, structs):
+        self.structs = structs
+
+        # struct.Struct of the fixed-size forms, keyed by form
+        self.fixed_forms = {}
+        for form, field in structs.Dwarf_dw_form.iteritems():
+            if isinstance(field, FormatField):
+                self.fixed_forms[form] = struct.Struct(field.packer.format)
+
+        # The sizes of the fixed-size forms, keyed by form
+        self.form_sizes = dict(
+            (form, value_struct.size)
+            for form, value_struct in self.fixed_forms.iteritems())
+
+        byteorder = '<' if structs.little_endian else '>'
+        self._block_lengths = {
+            'DW_FORM_block1': struct.Struct(byteorder + 'B'),
+            'DW_FORM_block2': struct.Struct(byteorder + 'H'),
+            'DW_FORM_block4': struct.Struct(byteorder + 'L')}
+
+    def skip(self, data, offset, form):
+        """ Return the offset right after the value of the given form at
+            offset of data. Values of fixed-size forms are not looked at, so
+            it's up to the caller to check the result against the size of the
+            data.
+        """
+        size = self.form_sizes.get(form)
+        if size is not None:
+            return offset + size
+        if form == 'DW_FORM_indirect':
+            code, offset = decode_uleb128(data, offset)
+            return self.skip(data, offset, self.indirect_form(code))
+        return self.read(data, offset, form)[1]
+
+    def read(self, data, offset, form):
+        """ Decode the raw value of the given form at offset of data. Return
+            the tuple (raw value, offset right after the value).
+
+            For DW_FORM_indirect the raw value is the code of the actual form,
+            whose value follows.
+        """
+        value_struct = self.fixed_forms.get(form)
+        if value_struct is not None:
+            try:
+                return (value_struct.unpack_from(data, offset)[0],
+                        offset + value_struct.size)
+            except struct.error:
+                raise ELFParseError(
+                    'Truncated %s value at offset %s' % (form, offset))
+        elif form in ('DW_FORM_udata', 'DW_FORM_ref_udata',
+                      'DW_FORM_indirect'):
+            return decode_uleb128(data, offset)
+        elif form == 'DW_FORM_sdata':
+            return decode_sleb128(data, offset)
+        elif form == 'DW_FORM_string':
+            end = data.find('\x00', offset)
+            if end < 0:
+                raise ELFParseError(
+                    'Unterminated string at offset %s' % offset)
+            return data[offset:end], end + 1
+        elif form == 'DW_FORM_block':
+            length, offset = decode_uleb128(data, offset)
+        elif form in self._block_lengths:
+            length_struct = self._block_lengths[form]
+            try:
+                length = length_struct.unpack_from(data, offset)[0]
+            except struct.error:
+                raise ELFParseError(
+                    'Truncated %s value at offset %s' % (form, offset))
+            offset += length_struct.size
+        else:
+            raise ELFParseError('Unknown form %s' % form)
+
+        # The blocks: a list of the bytes, like construct parses them
+        end = offset + length
+        if end > len(data):
+            raise ELFParseError(
+                'Truncated %s value at offset %s' % (form, offset))
+        return ListContainer(bytearray(data[offset:end])), end
+
+    def indirect_form(self, code):
+        """ The name of the form given by code, for DW_FORM_indirect
+        """
+        try:
+            return _FORM_NAMES[code]
+        except KeyError:
+            raise ELFParseError('Unknown form code %s' % code)
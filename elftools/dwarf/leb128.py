@@ -0,0 +1,114 @@
+#-------------------------------------------------------------------------------
+# elftools: dwarf/leb128.py
+#
+# Decoding of the LEB128 variable-length encoding (DWARF spec v3, section 7.6)
+# straight from strings and streams, without going through construct
+#
+# Davi Costa (davialcosta@gmail.com)
+# This code is in the public domain
+#-------------------------------------------------------------------------------
+from ..common.exceptions import ELFParseError
+
+
+def decode_uleb128(data, offset=0):
+    """ Decode a ULEB128 value from data (a string or buffer) at offset.
+        Return the tuple (value, offset right after the value)
+    """
+    try:
+        byte = ord(data[offset])
+        if byte < 0x80:
+            return byte, offset + 1
+        value = byte & 0x7F
+        shift = 7
+        while True:
+            offset += 1
+            byte = ord(data[offset])
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value, offset + 1
+            shift += 7
+    except IndexError:
+        raise ELFParseError('Truncated LEB128 value')
+
+
+def decode_sleb128(data, offset=0):
+    """ Decode a SLEB128 value from data (a string or buffer) at offset.
+        Return the tuple (value, offset right after the value)
+    """
+    try:
+        byte = ord(data[offset])
+        if byte < 0x80:
+            # One byte: sign extended from bit 6
+            return (byte - 0x80 if byte & 0x40 else byte), offset + 1
+        value = byte & 0x7F
+        shift = 7
+        while True:
+            offset += 1
+            byte = ord(data[offset])
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                if byte & 0x40:
+                    # negative -> sign extend
+                    value -= 1 << shift
+                return value, offset + 1
+    except IndexError:
+        raise ELFParseError('Truncated LEB128 value')
+
+
+def decode_uleb128_list(data, offset, count):
+    """ Decode count consecutive ULEB128 values from data at offset.
+        Return the tuple (list of values, offset right after the last value)
+    """
+    values = []
+    append = values.append
+    try:
+        for _ in xrange(count):
+            byte = ord(data[offset])
+            if byte < 0x80:
+                # The common case of a one byte value
+                append(byte)
+                offset += 1
+            else:
+                value, offset = decode_uleb128(data, offset)
+                append(value)
+    except IndexError:
+        raise ELFParseError('Truncated LEB128 value')
+    return values, offset
+
+
+def read_uleb128(stream):
+    """ Read a ULEB128 value from the current position of the stream, which
+        is left right after the value
+    """
+    byte = stream.read(1)
+    if byte and byte < '\x80':
+        return ord(byte)
+    value = shift = 0
+    while byte:
+        b = ord(byte)
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value
+        shift += 7
+        byte = stream.read(1)
+    raise ELFParseError('Truncated LEB128 value')
+
+
+def read_sleb128(stream):
+    """ Read a SLEB128 value from the current position of the stream, which
+        is left right after the value
+    """
+    value = shift = 0
+    byte = stream.read(1)
+    while byte:
+        b = ord(byte)
+        value |= (b & 0x7F) << shift
+        shift += 7
+        if b < 0x80:
+            if b & 0x40:
+                # negative -> sign extend
+                value -= 1 << shift
+            return value
+        byte = stream.read(1)
+    raise ELFParseError('Truncated LEB128 value')
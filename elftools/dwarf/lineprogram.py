@@ -6,11 +6,13 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
-import os
 import copy
+import struct
 from collections import namedtuple
 
-from ..common.utils import struct_parse
+from ..common.exceptions import ELFParseError
+from ..common.utils import struct_parse, dwarf_assert
+from .leb128 import decode_uleb128, decode_sleb128
 from .constants import *
 
 
@@ -137,12 +139,20 @@ class LineProgram(object):
             # Add an entry that doesn't visibly set a new state
             entries.append(LineProgramEntry(cmd, is_extended, args, None))
 
-        offset = self.program_start_offset
-        while offset < self.program_end_offset:
-            opcode = struct_parse(
-                self.structs.Dwarf_uint8(''), 
-                self.stream,
-                offset)
+        # The program is read once, and decoded from the string
+        self.stream.seek(self.program_start_offset)
+        data = self.stream.read(
+            self.program_end_offset - self.program_start_offset)
+        byteorder = '<' if self.structs.little_endian else '>'
+        uint8_struct = struct.Struct('B')
+        uint16_struct = struct.Struct(byteorder + 'H')
+        target_addr_struct = struct.Struct(
+            byteorder + ('I' if self.structs.address_size == 4 else 'Q'))
+
+        offset = 0
+        while offset < len(data):
+            opcode = ord(data[offset])
+            offset += 1
 
             # As an exercise in avoiding premature optimization, if...elif
             # chains are used here for standard and extended opcodes instead
@@ -162,10 +172,9 @@ class LineProgram(object):
             elif opcode == 0:
                 # Extended opcode: start with a zero byte, followed by
                 # instruction size and the instruction itself.
-                inst_len = struct_parse(self.structs.Dwarf_uleb128(''),
-                                        self.stream)
-                ex_opcode = struct_parse(self.structs.Dwarf_uint8(''),
-                                         self.stream)
+                inst_len, offset = decode_uleb128(data, offset)
+                ex_opcode = self._unpack_at(uint8_struct, data, offset)
+                offset += 1
 
                 if ex_opcode == DW_LNE_end_sequence:
                     state.end_sequence = True
@@ -173,44 +182,42 @@ class LineProgram(object):
                     # reset state
                     state = LineState(self.header['default_is_stmt']) 
                 elif ex_opcode == DW_LNE_set_address:
-                    operand = struct_parse(self.structs.Dwarf_target_addr(''),
-                                           self.stream)
+                    operand = self._unpack_at(target_addr_struct, data, offset)
+                    offset += target_addr_struct.size
                     state.address = operand
                     add_entry_old_state(ex_opcode, [operand], is_extended=True)
                 elif ex_opcode == DW_LNE_define_file:
                     operand = struct_parse(
-                        self.structs.Dwarf_lineprog_file_entry, self.stream)
+                        self.structs.Dwarf_lineprog_file_entry, self.stream,
+                        self.program_start_offset + offset)
+                    offset = self.stream.tell() - self.program_start_offset
                     self['file_entry'].append(operand)
                     add_entry_old_state(ex_opcode, [operand], is_extended=True)
                 else:
                     # Unknown, but need to roll forward the stream because the
-                    # length is specified. Seek forward inst_len - 1 because
-                    # we've already read the extended opcode, which takes part
-                    # in the length.
-                    self.stream.seek(inst_len - 1, os.SEEK_CUR)
+                    # length is specified. Skip inst_len - 1 because we've
+                    # already read the extended opcode, which takes part in
+                    # the length.
+                    offset += inst_len - 1
             else: # 0 < opcode < opcode_base
                 # Standard opcode
                 if opcode == DW_LNS_copy:
                     add_entry_new_state(opcode, [])
                 elif opcode == DW_LNS_advance_pc:
-                    operand = struct_parse(self.structs.Dwarf_uleb128(''),
-                                           self.stream)
+                    operand, offset = decode_uleb128(data, offset)
                     address_addend = (
                         operand * self.header['minimum_instruction_length'])
                     state.address += address_addend
                     add_entry_old_state(opcode, [address_addend])
                 elif opcode == DW_LNS_advance_line:
-                    operand = struct_parse(self.structs.Dwarf_sleb128(''),
-                                           self.stream)
+                    operand, offset = decode_sleb128(data, offset)
                     state.line += operand
                 elif opcode == DW_LNS_set_file:
-                    operand = struct_parse(self.structs.Dwarf_uleb128(''),
-                                           self.stream)
+                    operand, offset = decode_uleb128(data, offset)
                     state.file = operand
                     add_entry_old_state(opcode, [operand])
                 elif opcode == DW_LNS_set_column:
-                    operand = struct_parse(self.structs.Dwarf_uleb128(''),
-                                           self.stream)
+                    operand, offset = decode_uleb128(data, offset)
                     state.column = operand
                     add_entry_old_state(opcode, [operand])
                 elif opcode == DW_LNS_negate_stmt:
@@ -226,8 +233,8 @@ class LineProgram(object):
                     state.address += address_addend
                     add_entry_old_state(opcode, [address_addend])
                 elif opcode == DW_LNS_fixed_advance_pc:
-                    operand = struct_parse(self.structs.Dwarf_uint16(''),
-                                           self.stream)
+                    operand = self._unpack_at(uint16_struct, data, offset)
+                    offset += uint16_struct.size
                     state.address += operand
                     add_entry_old_state(opcode, [operand])
                 elif opcode == DW_LNS_set_prologue_end:
@@ -237,13 +244,19 @@ class LineProgram(object):
                     state.epilogue_begin = True
                     add_entry_old_state(opcode, [])
                 elif opcode == DW_LNS_set_isa:
-                    operand = struct_parse(self.structs.Dwarf_uleb128(''),
-                                           self.stream)
+                    operand, offset = decode_uleb128(data, offset)
                     state.isa = operand
                     add_entry_old_state(opcode, [operand])
                 else:
                     dwarf_assert(False, 'Invalid standard line program opcode: %s' % (
                         opcode,))
-            offset = self.stream.tell()
         return entries
 
+    def _unpack_at(self, value_struct, data, offset):
+        """ Unpack a single value with value_struct at offset of the program
+            data
+        """
+        if offset + value_struct.size > len(data):
+            raise ELFParseError('Truncated line program')
+        return value_struct.unpack_from(data, offset)[0]
+
@@ -10,10 +10,12 @@
 from ..construct import (
     UBInt8, UBInt16, UBInt32, UBInt64, ULInt8, ULInt16, ULInt32, ULInt64,
     SBInt8, SBInt16, SBInt32, SBInt64, SLInt8, SLInt16, SLInt32, SLInt64,
-    Adapter, Struct, ConstructError, If, RepeatUntil, Field, Rename, Enum,
-    Array, PrefixedArray, CString, Embed,
+    Adapter, Struct, ConstructError, If, Enum, Array, PrefixedArray, CString,
+    Embed, Construct, FieldError, SizeofError,
     )
 from ..common.construct_utils import RepeatUntilExcluding
+from ..common.exceptions import ELFParseError
+from .leb128 import read_uleb128, read_sleb128
 
 from .enums import *
 
@@ -264,48 +266,34 @@ class _InitialLengthAdapter(Adapter):
                     obj.first))
 
 
-def _LEB128_reader():
-    """ Read LEB128 variable-length data from the stream. The data is terminated
-        by a byte with 0 in its highest bit.
+class _LEB128(Construct):
+    """ A construct for LEB128 variable-length data, decoded with a reader
+        from leb128 (read_uleb128 or read_sleb128). The data is terminated by
+        a byte with 0 in its highest bit.
     """
-    return RepeatUntil(
-                lambda obj, ctx: ord(obj) < 0x80,
-                Field(None, 1))
+    __slots__ = ['reader']
+    def __init__(self, name, reader):
+        Construct.__init__(self, name)
+        self._set_flag(self.FLAG_DYNAMIC)
+        self.reader = reader
 
+    def _parse(self, stream, context):
+        try:
+            return self.reader(stream)
+        except ELFParseError as e:
+            raise FieldError(e.message)
 
-class _ULEB128Adapter(Adapter):
-    """ An adapter for ULEB128, given a sequence of bytes in a sub-construct.
-    """
-    def _decode(self, obj, context):
-        value = 0
-        for b in reversed(obj):
-            value = (value << 7) + (ord(b) & 0x7F)
-        return value
-
-
-class _SLEB128Adapter(Adapter):
-    """ An adapter for SLEB128, given a sequence of bytes in a sub-construct.
-    """
-    def _decode(self, obj, context):
-        value = 0
-        for b in reversed(obj):
-            value = (value << 7) + (ord(b) & 0x7F)
-        if ord(obj[-1]) & 0x40:
-            # negative -> sign extend
-            #
-            value |= - (1 << (7 * len(obj)))
-        return value
+    def _sizeof(self, context):
+        raise SizeofError("can't calculate size")
 
 
 def _ULEB128(name):
     """ A construct creator for ULEB128 encoding.
     """
-    return Rename(name, _ULEB128Adapter(_LEB128_reader()))
+    return _LEB128(name, read_uleb128)
 
 
 def _SLEB128(name):
     """ A construct creator for SLEB128 encoding.
     """
-    return Rename(name, _SLEB128Adapter(_LEB128_reader()))
-
-
+    return _LEB128(name, read_sleb128)
@@ -6,22 +6,28 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
+import mmap
 from cStringIO import StringIO
 from ..common.exceptions import ELFError
-from ..common.utils import struct_parse, elf_assert
+from ..common.utils import (struct_parse, struct_parse_from, elf_assert,
+                            stream_view)
 from ..construct import ConstructError
 from .structs import ELFStructs
 from .sections import (
         Section, StringTableSection, SymbolTableSection, NullSection)
-from .relocation import RelocationSection, RelocationHandler
+from .relocation import (
+        RelocationSection, RelocationHandler, RelocationIndex)
+from .hash import SysVHashSection, GNUHashSection
 from .segments import Segment, InterpSegment
+from .symbolizer import Symbolizer
 from .enums import ENUM_RELOC_TYPE_i386, ENUM_RELOC_TYPE_x64
 from ..dwarf.dwarfinfo import DWARFInfo, DebugSectionDescriptor, DwarfConfig
 
 
 class ELFFile(object):
     """ Creation: the constructor accepts a stream (file-like object) with the
-        contents of an ELF file.
+        contents of an ELF file. Alternatively, use from_path to open a file
+        through a read-only memory mapping.
     
         Accessible attributes:
 
@@ -50,9 +56,43 @@ class ELFFile(object):
 
         self.stream.seek(0)
         self.e_ident_raw = self.stream.read(16)
-        
+
+        # The section header table is decoded in bulk on first use, and the
+        # Section objects built from it are cached by index
+        self._section_headers = None
+        self._sections = [None] * self['e_shnum']
+
         self._file_stringtable_section = self._get_file_stringtable()
         self._section_name_map = None
+        self._section_type_map = None
+        # Maps a section index to the relocation sections for the section
+        self._relocation_map = None
+        self._relocation_index = None
+
+        # Symbolizer objects, created on demand for each section filter
+        self._symbolizers = {}
+
+    @classmethod
+    def from_path(cls, path, use_mmap=True, **kwargs):
+        """ Create an object for the ELF file at path.
+
+            If use_mmap is True the file is mapped read-only into memory and
+            used as the stream. Nothing is copied up front, and section and
+            segment data() return zero-copy views over the mapping.
+            Other keyword arguments are passed to the constructor.
+        """
+        if not use_mmap:
+            return cls(open(path, 'rb'), **kwargs)
+        # The mapping keeps its own reference to the file, so the file object
+        # itself can be closed right away
+        with open(path, 'rb') as f:
+            stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(stream, **kwargs)
+
+    def is_mapped(self):
+        """ Is the stream of this file a memory mapping?
+        """
+        return isinstance(self.stream, mmap.mmap)
     
     def num_sections(self):
         """ Number of sections in the file
@@ -61,10 +101,14 @@ class ELFFile(object):
     
     def get_section(self, n):
         """ Get the section at index #n from the file (Section object or a
-            subclass)
+            subclass). Section objects are created once and cached, so two
+            calls for the same index return the same object.
         """
-        section_header = self._get_section_header(n)
-        return self._make_section(section_header)
+        section = self._sections[n]
+        if section is None:
+            section = self._make_section(self._get_section_header(n))
+            self._sections[n] = section
+        return section
     
     def get_section_by_name(self, name):
         """ Get a section from the file, by name. Return None if no such 
@@ -79,7 +123,34 @@ class ELFFile(object):
                 self._section_name_map[sec.name] = i
         secnum = self._section_name_map.get(name, None)
         return None if secnum is None else self.get_section(secnum)
+
+    def get_sections_by_type(self, sectype):
+        """ Get a list of all the sections of the given type (for example
+            'SHT_SYMTAB'), in the order they appear in the file.
+        """
+        # Built on the first call, like the name to number mapping
+        if self._section_type_map is None:
+            self._section_type_map = {}
+            for i, sec in enumerate(self.iter_sections()):
+                self._section_type_map.setdefault(sec['sh_type'], []).append(i)
+        return [self.get_section(i)
+                for i in self._section_type_map.get(sectype, ())]
     
+    def get_relocation_sections(self, n):
+        """ Get a list of the relocation sections (RelocationSection objects)
+            for the section at index #n, in the order they appear in the file.
+        """
+        return [self.get_section(i)
+                for i in self._get_relocation_map().get(n, ())]
+
+    def get_relocation_index(self):
+        """ Get the RelocationIndex of the file, which finds relocations by
+            address and by symbol. It's created once.
+        """
+        if self._relocation_index is None:
+            self._relocation_index = RelocationIndex(self)
+        return self._relocation_index
+
     def iter_sections(self):
         """ Yield all the sections in the file
         """
@@ -103,6 +174,49 @@ class ELFFile(object):
         for i in range(self.num_segments()):
             yield self.get_segment(i)
 
+    def symbolize(self, addr, section=None):
+        """ Find the function or object symbol containing the address addr,
+            looking into both .symtab and .dynsym. Return a Symbol object, or
+            None if no symbol contains it.
+
+            If section (a section name) is given, only symbols defined in that
+            section are considered. This is required for relocatable files,
+            where symbol values are offsets into their sections.
+        """
+        return self._get_symbolizer(section).symbolize(addr)
+
+    def symbolize_many(self, addrs, section=None):
+        """ Like symbolize, for a sequence of addresses. Return a list with a
+            Symbol object (or None) for each address.
+        """
+        return self._get_symbolizer(section).symbolize_many(addrs)
+
+    def get_dynamic_symbol(self, name):
+        """ Find a symbol defined in .dynsym by name. Return a Symbol object,
+            or None if there's none.
+
+            The lookup goes through the hash table of the file, as done by
+            the dynamic loader: .gnu.hash if present, otherwise .hash. Files
+            with neither are searched linearly.
+        """
+        undefined = ('SHN_UNDEF', 0)
+        for sectype in ('SHT_GNU_HASH', 'SHT_HASH'):
+            for hash_section in self.get_sections_by_type(sectype):
+                if hash_section.get_symbol_table()['sh_type'] != 'SHT_DYNSYM':
+                    continue
+                symbol = hash_section.get_symbol(name)
+                if symbol is not None and symbol['st_shndx'] in undefined:
+                    # .hash also holds the undefined symbols
+                    symbol = None
+                return symbol
+
+        for dynsym in self.get_sections_by_type('SHT_DYNSYM'):
+            arrays = dynsym.as_arrays(use_numpy=False)
+            for n, symbol_name in enumerate(arrays.get_names()):
+                if symbol_name == name and arrays.st_shndx[n] != 0:
+                    return dynsym.get_symbol(n)
+        return None
+
     def has_dwarf_info(self):
         """ Check whether this file appears to have debugging information. 
             We assume that if it has the debug_info section, it has all theother
@@ -121,17 +235,31 @@ class ELFFile(object):
         # present. 
         # Sections that aren't found will be passed as None to DWARFInfo.
         #
+        # The sections are read (and relocated) on first use, so a caller
+        # only pays for the sections it reads.
+        #
         debug_sections = {}
         for secname in ('.debug_info', '.debug_abbrev', '.debug_str', 
                         '.debug_line', '.debug_frame', '.debug_loc',
                         '.debug_ranges'):
-            section = self.get_section_by_name(secname)
-            if section is None:
-                debug_sections[secname] = None
-            else:
+            debug_sections[secname] = self.get_section_by_name(secname)
+
+        # A single handler, so the symbol values are decoded once. Linked
+        # files (ET_EXEC, ET_DYN) usually have no relocations for their debug
+        # sections, and then relocation is skipped entirely.
+        reloc_handler = None
+        if relocate_dwarf_sections and any(
+                self.get_relocation_sections(self._section_index(section))
+                for section in debug_sections.itervalues()
+                if section is not None):
+            reloc_handler = RelocationHandler(self)
+
+        for secname, section in debug_sections.items():
+            if section is not None:
                 debug_sections[secname] = self._read_dwarf_section(
                         section,
-                        relocate_dwarf_sections)
+                        reloc_handler is not None,
+                        reloc_handler)
 
         return DWARFInfo(
                 config=DwarfConfig(
@@ -191,6 +319,54 @@ class ELFFile(object):
         else:
             raise ELFError('Invalid EI_DATA %s' % repr(ei_data))
     
+    def _section_index(self, section):
+        """ Index of a section object of the file, or None
+        """
+        self.get_section_by_name('')
+        n = self._section_name_map.get(section.name)
+        if n is not None and self.get_section(n) is section:
+            return n
+        # Several sections with the same name
+        for i, sec in enumerate(self.iter_sections()):
+            if sec is section:
+                return i
+        return None
+
+    def _get_relocation_map(self):
+        """ Get the map built by _build_relocation_map
+        """
+        # Built on the first call, like the name to number mapping
+        if self._relocation_map is None:
+            self._relocation_map = self._build_relocation_map()
+        return self._relocation_map
+
+    def _build_relocation_map(self):
+        """ Map the index of each relocated section to the list of indexes of
+            its relocation sections. The relocated section is the one in
+            sh_info, or if there's none the one named after the relocation
+            section (.rel<name> or .rela<name>).
+        """
+        # Force creation of the name and type mappings
+        self.get_section_by_name('')
+        self.get_sections_by_type('SHT_REL')
+        reloc_indexes = sorted(self._section_type_map.get('SHT_REL', []) +
+                               self._section_type_map.get('SHT_RELA', []))
+        relocation_map = {}
+        for i in reloc_indexes:
+            section = self.get_section(i)
+            target = section['sh_info']
+            if not 0 < target < self.num_sections():
+                target = None
+                for prefix in ('.rela', '.rel'):
+                    if section.name.startswith(prefix):
+                        target = self._section_name_map.get(
+                            section.name[len(prefix):])
+                        if target is not None:
+                            break
+            if target is not None:
+                relocation_map.setdefault(target, []).append(i)
+        return relocation_map
+
     def _section_offset(self, n):
         """ Compute the offset of section #n in the file
         """
@@ -201,6 +377,20 @@ class ELFFile(object):
         """
         return self['e_phoff'] + n * self['e_phentsize']
     
+    def _get_symbolizer(self, section):
+        """ Get the Symbolizer for symbols in the named section (or in any
+            section, if None)
+        """
+        if section not in self._symbolizers:
+            if section is None:
+                index = None
+            else:
+                elf_assert(self.get_section_by_name(section) is not None,
+                    'Unknown section %s' % section)
+                index = self._section_name_map[section]
+            self._symbolizers[section] = Symbolizer(self, section=index)
+        return self._symbolizers[section]
+
     def _make_segment(self, segment_header):
         """ Create a Segment object of the appropriate type
         """
@@ -211,12 +401,25 @@ class ELFFile(object):
             return Segment(segment_header, self.stream)
 
     def _get_section_header(self, n):
-        """ Find the header of section #n, parse it and return the struct 
+        """ Find the header of section #n and return the struct
         """
-        return struct_parse(
-            self.structs.Elf_Shdr,
+        if self._section_headers is None:
+            self._section_headers = self._parse_section_headers()
+        return self._section_headers[n]
+
+    def _parse_section_headers(self):
+        """ Parse the whole section header table and return a tuple with the
+            header of each section. The table is read from the stream in a
+            single read and decoded sequentially from memory.
+        """
+        shentsize = self['e_shentsize']
+        table = stream_view(
             self.stream,
-            stream_pos=self._section_offset(n))
+            self['e_shoff'],
+            self['e_shnum'] * shentsize)
+        return tuple(
+            struct_parse_from(self.structs.Elf_Shdr, table, n * shentsize)
+            for n in range(self['e_shnum']))
     
     def _get_section_name(self, section_header):
         """ Given a section header, find this section's name in the file's
@@ -240,6 +443,10 @@ class ELFFile(object):
         elif sectype in ('SHT_REL', 'SHT_RELA'):
             return RelocationSection(
                 section_header, name, self.stream, self)
+        elif sectype == 'SHT_GNU_HASH':
+            return GNUHashSection(section_header, name, self.stream, self)
+        elif sectype == 'SHT_HASH':
+            return SysVHashSection(section_header, name, self.stream, self)
         else:
             return Section(section_header, name, self.stream)
 
@@ -276,28 +483,38 @@ class ELFFile(object):
         """
         return struct_parse(self.structs.Elf_Ehdr, self.stream, stream_pos=0)
 
-    def _read_dwarf_section(self, section, relocate_dwarf_sections):
-        """ Read the contents of a DWARF section from the stream and return a
-            DebugSectionDescriptor. Apply relocations if asked to.
+    def _read_dwarf_section(self, section, relocate_dwarf_sections,
+                            reloc_handler=None):
+        """ Return a DebugSectionDescriptor for a DWARF section. Its contents
+            are read from the stream on first access, and relocations applied
+            if asked to, with reloc_handler if given.
         """
-        self.stream.seek(section['sh_offset'])
-        # The section data is read into a new stream, for processing
-        section_stream = StringIO()
-        # Using .write instead of initializing StringIO with the string because
-        # such a StringIO from cStringIO is read-only.
-        section_stream.write(self.stream.read(section['sh_size']))
-
-        if relocate_dwarf_sections:
-            reloc_handler = RelocationHandler(self)
-            reloc_section = reloc_handler.find_relocations_for_section(section)
-            if reloc_section is not None:
-                reloc_handler.apply_section_relocations(
-                        section_stream, reloc_section)
-
         return DebugSectionDescriptor(
-                stream=section_stream,
+                stream=None,
+                loader=lambda: self._load_dwarf_section(
+                    section, relocate_dwarf_sections, reloc_handler),
                 name=section.name,
                 global_offset=section['sh_offset'],
                 size=section['sh_size'])
 
+    def _load_dwarf_section(self, section, relocate_dwarf_sections,
+                            reloc_handler=None):
+        """ Read the contents of a DWARF section, relocated if asked to, with
+            reloc_handler if given
+        """
+        reloc_section = None
+        if relocate_dwarf_sections:
+            if reloc_handler is None:
+                reloc_handler = RelocationHandler(self)
+            reloc_section = reloc_handler.find_relocations_for_section(section)
+        if reloc_section is None:
+            return section.data()
+
+        # Using .write instead of initializing StringIO with the string because
+        # such a StringIO from cStringIO is read-only.
+        section_stream = StringIO()
+        section_stream.write(section.data())
+        reloc_handler.apply_section_relocations(section_stream, reloc_section)
+        return section_stream.getvalue()
+
 
@@ -7,35 +7,52 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 
+import mmap
+import os
+import stat
+import tempfile
 from io import BytesIO
+from ..common.utils import elf_assert, struct_parse
 from .elffile import ELFFile
 from .sectionsedit import (
-    SymbolTableSectionEdit, StringTableSectionEdit, SymbolEdit)
-from copy import deepcopy
+    SymbolTableSectionEdit, StringTableSectionEdit, SymbolEdit, SymbolBatch)
+
+# The umask of the process, for the permissions of new files. It can only be
+# read by setting it, so it's done once, on import
+_UMASK = os.umask(022)
+os.umask(_UMASK)
 
 class ELFFileEdit(ELFFile):
     """ 
     """
     
-    def __init__(self, stream):
-        # Create a copy of the stream
-        stream.seek(0)
-        self.stream = BytesIO()
-        self.stream.write(stream.read())
+    def __init__(self, stream, lazy=False):
+        # A read-only mapping can be shared as is, since edits are kept in
+        # the editable sections and never written back to the stream.
+        # Any other stream is copied, as the caller may close or overwrite it.
+        if isinstance(stream, mmap.mmap):
+            self.stream = stream
+        else:
+            stream.seek(0)
+            self.stream = BytesIO()
+            self.stream.write(stream.read())
 
         # Call parent constructor
         super(ELFFileEdit, self).__init__(self.stream)
         self._file_stringtable_section.name = self._get_section_name(self._file_stringtable_section.header)
         
         # Control of new and editable sections
+        # Editable sections are keyed by the index of the section they replace
         self._new_sections = []
-        self._edit_sections = []
+        self._edit_sections = {}
+        # Were sections added since the file was loaded or saved?
+        self._sections_added = False
 
         self.stream.seek(0,2)
         self.size = self.stream.tell()
         self._normal = self._check_normal()
 
-        self._load_edit_sections()
+        self._load_edit_sections(lazy)
 
         # Set the writting offset 
         # If the file is considered to be "normal" it will be the offset
@@ -45,13 +62,25 @@ class ELFFileEdit(ELFFile):
         else:
             self.offset = self.size
 
+        # Size, e_shoff and e_shnum of the file described by the editable
+        # sections, checked before patching it
+        self._file_layout = (self.size, self['e_shoff'], self['e_shnum'])
+
     def get_section_name_map(self):
+        """ Get a copy of the mapping: section name to index """
         if self._section_name_map == None:
             self.get_section_by_name('')
-        return deepcopy(self._section_name_map)
+        return dict(self._section_name_map)
 
     def save(self, fname):
-        """ Creates a file fname with the updated information """
+        """ Creates a file fname with the updated information
+        The file is written to a temporary file in the same directory, which
+        is then renamed to fname. So fname is never left half written, and
+        it can be the file being edited. If fname is a symbolic link, the
+        file it points to is replaced. The permissions of a replaced file are
+        kept, but not its owner and group, and it's no longer a hard link
+        of other files.
+        """
         # Set the shstrtab offset and get the offset for the section headers
         off = self._shstrtab.fix_header(self.offset)
    
@@ -75,31 +104,85 @@ class ELFFileEdit(ELFFile):
                                + self._symtab['sh_size'])
         
         # Write the output file
-        out = open(fname,"w")
-
-        # Write the elf header
-        self.structs.Elf_Ehdr.build_stream(eh, out)
-
-        # copy everything until the section string table 
-        self.stream.seek(self['e_ehsize'])
-        out.write(self.stream.read(self.offset - self['e_ehsize']))
-
-        # Write the section string table
-        out.write(self._shstrtab.data())
-        
-        # Align address
-        while (out.tell()%(self.elfclass/8) != 0):
-            out.write('\0')
-        
-        # Write the sections Headers
-        for sec in self.iter_sections():
-            self.structs.Elf_Shdr.build_stream(sec.header, out)
-
-        # Finally, write the Symbol and the String table
-        out.write(self._symtab.data())
-        out.write(self._strtab.data())
-
-        out.close()
+        fname = os.path.realpath(fname)
+        dirname, basename = os.path.split(fname)
+        fd, tmpname = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                self._write(out, eh)
+                size = out.tell()
+            os.chmod(tmpname, self._file_mode(fname))
+            os.rename(tmpname, fname)
+        except:
+            os.unlink(tmpname)
+            raise
+
+        # The editable sections now describe the saved file
+        self._file_layout = (size, eh['e_shoff'], eh['e_shnum'])
+        self._sections_added = False
+        self._symtab.saved()
+
+    def save_in_place(self, fname):
+        """ Save the changes to fname, the file being edited (or the last
+        file it was saved to). If possible the file is patched (see patch),
+        otherwise the whole file is saved.
+        Returns True if the file was patched.
+        """
+        if self.can_patch():
+            self.patch(fname)
+            return True
+        self.save(fname)
+        return False
+
+    def can_patch(self):
+        """ Check if the changes can be written by patching the file.
+        It's possible when no section and no symbol was added or removed,
+        and no changed symbol has to move between the local and the global
+        symbols. New symbol names must be found in the string table,
+        unless it's at the end of the file.
+        """
+        return self._patch_error() is None
+
+    def patch(self, fname):
+        """ Write the changes to fname, the file being edited (or the last
+        file it was saved to), in place. Only the entries of the changed
+        symbols are written, and the new symbol names at the end of the
+        string table. Unlike save, the file is changed in place, so it's
+        left half written if this fails.
+        """
+        error = self._patch_error()
+        elf_assert(error is None, "Can't patch %s: %s" % (fname, error))
+        size, shoff, shnum = self._file_layout
+        symtab = self._symtab
+        strtab = self._strtab
+
+        with open(fname, 'r+b') as out:
+            eh = struct_parse(self.structs.Elf_Ehdr, out, 0)
+            out.seek(0, 2)
+            elf_assert((out.tell(), eh['e_shoff'], eh['e_shnum']) ==
+                       self._file_layout,
+                       "%s isn't the file being edited" % fname)
+
+            # Names of renamed symbols, found in the string table or added to
+            # its end
+            symtab.push_modified_names(strtab)
+
+            for n, data in symtab.modified_entries():
+                out.seek(symtab['sh_offset'] + n * symtab['sh_entsize'])
+                out.write(data)
+
+            if strtab._size > strtab['sh_size']:
+                start = strtab['sh_size']
+                out.seek(strtab['sh_offset'] + start)
+                out.write(strtab.table[start:])
+                size += strtab._size - start
+                strtab.fix_header(strtab['sh_offset'])
+                out.seek(shoff +
+                         self._section_index(strtab) * self['e_shentsize'])
+                out.write(self.structs.Elf_Shdr.build(strtab.header))
+
+        self._file_layout = (size, shoff, shnum)
+        symtab.saved()
 
     # Symbol editing methods, basically wrappers over 
     # SymbolTableSectionEdit
@@ -136,6 +219,10 @@ class ELFFileEdit(ELFFile):
         """ Get a symbol by it's name """
         return self._symtab.get_symbol_by_name(name)
 
+    def get_symbols_by_name(self, name):
+        """ Get every symbol with the given name """
+        return self._symtab.get_symbols_by_name(name)
+
     def remove_symbol(self, n):
         """ Remove a symbol given an index
         indexes after it will be modified """
@@ -145,6 +232,22 @@ class ELFFileEdit(ELFFile):
         """ Remove a symbol given it's name """
         return self._symtab.remove_symbol_by_name(name)
 
+    def apply_symbol_changes(self, adds=(), removes=(), renames=()):
+        """ Add, remove and rename many symbols at once, see
+        SymbolTableSectionEdit.apply_symbol_changes
+        """
+        return self._symtab.apply_symbol_changes(adds, removes, renames)
+
+    def batch(self):
+        """ Collect symbol changes to apply them at once, at the end of a
+        with block:
+            with f.batch() as b:
+                b.create_symbol('f', 0x1000)
+                b.remove_symbol_by_name('g')
+                b.rename_symbol('h', 'new_h')
+        """
+        return SymbolBatch(self._symtab)
+
     # Overwrite a few methods to make it consistent
     # with editable and new sections
     def num_sections(self):
@@ -157,18 +260,91 @@ class ELFFileEdit(ELFFile):
             subclass)
         """
         if (n < self['e_shnum']):
-            section = super(ELFFileEdit,self).get_section(n)
             # Verify if the section is being editted
-            for esec in self._edit_sections:
-                if esec.name == section.name:
-                    section = esec
-                    break
+            section = self._edit_sections.get(n)
+            if section is None:
+                section = super(ELFFileEdit,self).get_section(n)
         else:
             section = self._new_sections[n - self['e_shnum']]
         return section
 
     #-------------------------------- PRIVATE --------------------------------#
 
+    # Size of the chunks used to copy data from a stream which isn't mapped
+    _COPY_CHUNK_SIZE = 1 << 20
+
+    def _write(self, out, eh):
+        """ Write the file to out, with eh as the elf header. fix_header must
+        have been called for the editable sections
+        """
+        # Write the elf header
+        self.structs.Elf_Ehdr.build_stream(eh, out)
+
+        # copy everything until the section string table
+        self._copy_stream(out, self['e_ehsize'], self.offset)
+
+        # Write the section string table
+        shstrtab = self._shstrtab.data()
+        out.write(shstrtab)
+
+        # Align address
+        out.write('\0' * (eh['e_shoff'] - self.offset - len(shstrtab)))
+
+        # Write the sections Headers
+        out.write(''.join(self.structs.Elf_Shdr.build(sec.header)
+                          for sec in self.iter_sections()))
+
+        # Finally, write the Symbol and the String table
+        out.write(self._symtab.data())
+        out.write(self._strtab.data())
+
+    def _copy_stream(self, out, start, end):
+        """ Copy the data of the original file between offsets start and end
+        to out. A mapped file is written straight from the mapping, without
+        copying it first. Any other stream is copied in chunks.
+        """
+        if end <= start:
+            return
+        if self.is_mapped():
+            out.write(buffer(self.stream, start, end - start))
+            return
+        self.stream.seek(start)
+        while start < end:
+            chunk = self.stream.read(min(self._COPY_CHUNK_SIZE, end - start))
+            if not chunk:
+                break
+            out.write(chunk)
+            start += len(chunk)
+
+    def _file_mode(self, fname):
+        """ Permissions for a saved file: the ones of the file being replaced,
+        or the default ones for a new file
+        """
+        try:
+            return stat.S_IMODE(os.stat(fname).st_mode)
+        except OSError:
+            return 0666 & ~_UMASK
+
+    def _patch_error(self):
+        """ Why the changes can't be written by patching the file, or None
+        """
+        if self._sections_added:
+            return 'sections were added'
+        symtab = self._symtab
+        strtab = self._strtab
+        if symtab._reordered:
+            return 'symbols were added or removed'
+        if symtab.local_symbols_moved():
+            return 'symbols moved between the local and the global symbols'
+        size = self._file_layout[0]
+        if strtab['sh_offset'] + strtab['sh_size'] != size:
+            for sym in symtab.modified_symbols():
+                if (sym['st_name'] == 0 and
+                        strtab.find_string(sym.name) is None):
+                    return ("the string table isn't at the end of the file "
+                            "and can't be extended")
+        return None
+
     def _check_normal(self):
         """ Check if the file is considered to be in the normal format
         A normal format is a file having:
@@ -206,39 +382,51 @@ class ELFFileEdit(ELFFile):
             return False
         return True
 
-    def _load_edit_sections(self):
+    def _load_edit_sections(self, lazy=False):
         """ Loads section string table, symbol table, and string table 
         as editable sections. If the two lasts don't exist, create them.
+        If lazy is True the symbols are left in the file until they're
+        changed, see SymbolTableSectionEdit.
         """
         # Stringtable section (contains sections names), always exists
         # _file_stringtable_section is used to keep consistent with parent class
         self._shstrtab = StringTableSectionEdit(self, self._file_stringtable_section)
         self._file_stringtable_section = self._shstrtab
-        self._edit_sections = [self._shstrtab,]
+        edit_sections = {self['e_shstrndx']: self._shstrtab}
+
+        # Look both indexes up before adding any section, which resets the
+        # name mapping
+        section_map = self.get_section_name_map()
+        symtab_index = section_map.get('.symtab')
+        strtab_index = section_map.get('.strtab')
 
         # Symbol table, load/create
-        if self.get_section_by_name('.symtab'):
+        if symtab_index is not None:
             self._symtab = SymbolTableSectionEdit(
-                self, self.get_section_by_name('.symtab'))           
+                self, self.get_section(symtab_index), lazy=lazy)
+            edit_sections[symtab_index] = self._symtab
         else:
             self._symtab = self._add_section(SymbolTableSectionEdit(self))
 
         # String table, load/create
-        if self.get_section_by_name('.strtab'):
+        if strtab_index is not None:
             self._strtab = StringTableSectionEdit(
-                self, self.get_section_by_name('.strtab'))
+                self, self.get_section(strtab_index))
+            edit_sections[strtab_index] = self._strtab
         else:
             self._strtab = self._add_section(StringTableSectionEdit(self))
 
-        self._edit_sections.extend([self._strtab, self._symtab, self._strtab])
-
+        self._edit_sections = edit_sections
 
     def _add_section(self, section):
         """ Add a section object to the file """
         assert self.get_section_by_name(section.name) == None
 
-        # Reset section name mapping
+        # Reset section name and type mappings
         self._section_name_map = None
+        self._section_type_map = None
+        self._relocation_map = None
+        self._sections_added = True
 
         # Add the string in the shstrtab and update the offset in the header
         section.header['sh_name'] = self._shstrtab.add_string(section.name)
@@ -0,0 +1,156 @@
+#-------------------------------------------------------------------------------
+# elftools: elf/hash.py
+#
+# ELF hash table sections (.hash and .gnu.hash)
+#
+# Davi Costa (davialcosta@gmail.com)
+# This code is in the public domain
+#-------------------------------------------------------------------------------
+import struct
+
+from ..common.utils import elf_assert, stream_view
+from .sections import Section
+
+
+def elf_hash(name):
+    """ The hash function of SysV hash tables (SHT_HASH)
+    """
+    h = 0
+    for c in name:
+        h = (h << 4) + ord(c)
+        g = h & 0xf0000000
+        if g:
+            h ^= g >> 24
+        h &= ~g & 0xffffffff
+    return h
+
+
+def gnu_hash(name):
+    """ The hash function of GNU hash tables (SHT_GNU_HASH)
+    """
+    h = 5381
+    for c in name:
+        h = (h * 33 + ord(c)) & 0xffffffff
+    return h
+
+
+class HashSection(Section):
+    """ Base class of hash table sections. The hash table is over the
+        symbols of the symbol table linked to it (usually .dynsym), and is
+        read on the first lookup.
+    """
+    def __init__(self, header, name, stream, elffile):
+        super(HashSection, self).__init__(header, name, stream)
+        self.elffile = elffile
+        self._table = None
+
+    def get_symbol_table(self):
+        """ The symbol table section this hash table is over
+        """
+        return self.elffile.get_section(self['sh_link'])
+
+    def get_symbol(self, name):
+        """ Find a symbol by name, as the dynamic loader does. Return a
+            Symbol object, or None if the table has no symbol with this name.
+        """
+        symtab = self.get_symbol_table()
+        for n in self._candidates(name):
+            symbol = symtab.get_symbol(n)
+            if symbol.name == name:
+                return symbol
+        return None
+
+    #------ PRIVATE ------#
+
+    def _get_table(self):
+        """ The decoded table, read on first use
+        """
+        if self._table is None:
+            self._table = self._parse_table(
+                stream_view(self.stream, self['sh_offset'], self['sh_size']))
+        return self._table
+
+    def _unpack_words(self, data, offset, count, fmt='I'):
+        """ Unpack count words of the given struct format at offset of data.
+            Return a tuple
+        """
+        elf_assert(offset + count * struct.calcsize(fmt) <= len(data),
+                'Hash table %s is truncated' % self.name)
+        return struct.unpack_from(
+            '%s%d%s' % (self.elffile.structs.byteorder, count, fmt),
+            data, offset)
+
+
+class SysVHashSection(HashSection):
+    """ SysV hash table section (SHT_HASH): a list of buckets, each one the
+        start of a chain of symbol indexes with the same hash.
+    """
+    def _candidates(self, name):
+        """ Yield the indexes of the symbols that may be named name
+        """
+        buckets, chains = self._get_table()
+        if not buckets:
+            return
+        n = buckets[elf_hash(name) % len(buckets)]
+        # Symbol 0 ends the chains
+        while 0 < n < len(chains):
+            yield n
+            n = chains[n]
+
+    def _parse_table(self, data):
+        """ Decode the table. Return the tuples (buckets, chains)
+        """
+        nbucket, nchain = self._unpack_words(data, 0, 2)
+        buckets = self._unpack_words(data, 8, nbucket)
+        chains = self._unpack_words(data, 8 + 4 * nbucket, nchain)
+        return buckets, chains
+
+
+class GNUHashSection(HashSection):
+    """ GNU hash table section (SHT_GNU_HASH). A bloom filter rejects most of
+        the names that aren't in the table. Each bucket holds the first
+        symbol with a hash in the bucket, and the hashes of the symbols
+        (sorted by bucket) are kept in a chain, the lowest bit set for the
+        last symbol of a bucket. Only the symbols from symoffset on are in
+        the table.
+    """
+    def _candidates(self, name):
+        """ Yield the indexes of the symbols that may be named name
+        """
+        symoffset, bloom_shift, bloom, buckets, chains = self._get_table()
+        if not buckets or not bloom:
+            return
+        h = gnu_hash(name)
+        bits = self.elffile.elfclass
+        word = bloom[(h // bits) % len(bloom)]
+        mask = (1 << (h % bits)) | (1 << ((h >> bloom_shift) % bits))
+        if word & mask != mask:
+            return
+        n = buckets[h % len(buckets)]
+        if n < symoffset:
+            return
+        while n - symoffset < len(chains):
+            chain_hash = chains[n - symoffset]
+            if chain_hash | 1 == h | 1:
+                yield n
+            if chain_hash & 1:
+                break
+            n += 1
+
+    def _parse_table(self, data):
+        """ Decode the table. Return the tuple
+            (symoffset, bloom_shift, bloom, buckets, chains)
+        """
+        nbucket, symoffset, bloom_size, bloom_shift = \
+            self._unpack_words(data, 0, 4)
+        offset = 16
+        word_format = 'I' if self.elffile.elfclass == 32 else 'Q'
+        bloom = self._unpack_words(data, offset, bloom_size, word_format)
+        offset += bloom_size * self.elffile.elfclass // 8
+        buckets = self._unpack_words(data, offset, nbucket)
+        offset += 4 * nbucket
+        # The chains go on up to the end of the symbol table
+        nchain = self.get_symbol_table().num_symbols() - symoffset
+        chains = self._unpack_words(data, offset,
+            max(0, min(nchain, (len(data) - offset) // 4)))
+        return symoffset, bloom_shift, bloom, buckets, chains
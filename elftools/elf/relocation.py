@@ -6,13 +6,21 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
+import struct
+from bisect import bisect_left
 from collections import namedtuple
 
 from ..common.exceptions import ELFRelocationError
-from ..common.utils import elf_assert, struct_parse
-from .sections import Section
+from ..common.utils import elf_assert, struct_parse, struct_parse_from
+from .sections import Section, decode_entries
 from .enums import ENUM_RELOC_TYPE_i386, ENUM_RELOC_TYPE_x64
 
+# NumPy is optional. When available, relocations are applied with it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Relocation(object):
     """ Relocation object - representing a single relocation entry. Allows
@@ -86,8 +94,178 @@ class RelocationSection(Section):
     def iter_relocations(self):
         """ Yield all the relocations in the section
         """
+        # The section is read once, and the entries decoded from it
+        data = self.data()
+        entsize = self['sh_entsize']
         for i in range(self.num_relocations()):
-            yield self.get_relocation(i)
+            entry = struct_parse_from(self.entry_struct, data, i * entsize)
+            yield Relocation(entry, self.elffile)
+
+    def as_arrays(self, use_numpy=None):
+        """ Decode the whole section in one pass into a RelocationArrays
+            object. NumPy arrays are used if use_numpy is True, or if it's
+            None and NumPy is available. Otherwise the columns are lists.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        return RelocationArrays(self, use_numpy)
+
+
+class RelocationArrays(object):
+    """ Columnar representation of a relocation section. Each column holds
+        one field for every relocation of the section, indexed by
+        relocation number.
+
+        Accessible attributes:
+
+            r_offset, r_info_sym, r_info_type:
+                The fields of the entries, r_info taken apart
+
+            r_addend:
+                The addends of a RELA section, None for a REL section
+    """
+    def __init__(self, reloc_section, use_numpy):
+        self.use_numpy = use_numpy
+        self.num_relocations = reloc_section.num_relocations()
+
+        structs = reloc_section.elfstructs
+        if reloc_section.is_RELA():
+            fields = structs.Elf_Rela_fields
+        else:
+            fields = structs.Elf_Rel_fields
+        columns = decode_entries(
+            reloc_section.data(), fields, structs.byteorder,
+            reloc_section['sh_entsize'], self.num_relocations, use_numpy)
+
+        self.r_offset = columns['r_offset']
+        self.r_addend = columns.get('r_addend')
+        r_info = columns['r_info']
+        if structs.elfclass == 32:
+            shift, type_mask = 8, 0xFF
+        else:
+            shift, type_mask = 32, 0xFFFFFFFF
+        if use_numpy:
+            self.r_info_sym = r_info >> shift
+            self.r_info_type = r_info & type_mask
+        else:
+            self.r_info_sym = [info >> shift for info in r_info]
+            self.r_info_type = [info & type_mask for info in r_info]
+
+
+class RelocationIndex(object):
+    """ Index of the relocations of a file, to find the relocations that
+        patch a range of addresses and the relocations that reference a
+        symbol.
+
+        It's built on the first query of each kind, in a pass over the
+        relocation sections decoded in bulk. The relocations are kept sorted
+        by r_offset for each relocated section, and by symbol for each symbol
+        table, so a query is a binary search.
+    """
+    def __init__(self, elffile):
+        self.elffile = elffile
+        self._by_offset = None
+        self._by_symbol = None
+
+    def get_relocations_in_range(self, section, start, end):
+        """ Get the relocations of section (a section index) with
+            start <= r_offset < end, sorted by r_offset (Relocation objects).
+            Relocations with no relocated section (such as the ones of
+            .rela.dyn) are found with section None, by virtual address.
+        """
+        if self._by_offset is None:
+            self._by_offset = self._build_tables(
+                'r_offset', self._relocated_sections())
+        return self._lookup(self._by_offset.get(section), start, end)
+
+    def get_relocations_at(self, section, offset):
+        """ Get the relocations of section with r_offset == offset, see
+            get_relocations_in_range
+        """
+        return self.get_relocations_in_range(section, offset, offset + 1)
+
+    def get_relocations_for_symbol(self, symtab, n):
+        """ Get the relocations referencing symbol #n of the symbol table at
+            index symtab (Relocation objects), in the order of the file.
+        """
+        if self._by_symbol is None:
+            self._by_symbol = self._build_tables('r_info_sym', dict(
+                (i, self.elffile.get_section(i)['sh_link'])
+                for i in self._relocation_section_indexes()))
+        return self._lookup(self._by_symbol.get(symtab), n, n + 1)
+
+    #------ PRIVATE ------#
+
+    def _relocation_section_indexes(self):
+        """ Indexes of the relocation sections of the file, in order
+        """
+        self.elffile.get_sections_by_type('SHT_REL')
+        type_map = self.elffile._section_type_map
+        return sorted(type_map.get('SHT_REL', []) +
+                      type_map.get('SHT_RELA', []))
+
+    def _relocated_sections(self):
+        """ Map each relocation section index to the index of the section it
+            relocates, or None
+        """
+        relocated = dict((i, None) for i in self._relocation_section_indexes())
+        for target, indexes in self.elffile._get_relocation_map().items():
+            for i in indexes:
+                relocated[i] = target
+        return relocated
+
+    def _build_tables(self, column, groups):
+        """ Group the relocations by the group of their section (groups maps
+            a relocation section index to its group), and sort each group
+            by the given column of RelocationArrays. Return a dict mapping
+            each group to the tuple (keys, sections, numbers): the sorted
+            column and, for each relocation, the index of its section and its
+            number in it.
+        """
+        parts = {}
+        for i in sorted(groups):
+            arrays = self.elffile.get_section(i).as_arrays()
+            parts.setdefault(groups[i], []).append(
+                (i, getattr(arrays, column)))
+
+        tables = {}
+        for group, group_parts in parts.items():
+            if numpy is not None:
+                keys = numpy.concatenate(
+                    [numpy.asarray(k, dtype=numpy.uint64)
+                     for _, k in group_parts])
+                sections = numpy.concatenate(
+                    [numpy.repeat(i, len(k)) for i, k in group_parts])
+                numbers = numpy.concatenate(
+                    [numpy.arange(len(k)) for _, k in group_parts])
+                # Stable, so equal keys stay in the order of the file
+                order = numpy.argsort(keys, kind='mergesort')
+                tables[group] = (keys[order], sections[order].tolist(),
+                                 numbers[order].tolist())
+            else:
+                entries = sorted(
+                    (key, i, n) for i, k in group_parts
+                    for n, key in enumerate(k))
+                tables[group] = ([e[0] for e in entries],
+                                 [e[1] for e in entries],
+                                 [e[2] for e in entries])
+        return tables
+
+    def _lookup(self, table, start, end):
+        """ The relocations of a table of _build_tables with
+            start <= key < end
+        """
+        if table is None:
+            return []
+        keys, sections, numbers = table
+        if numpy is not None:
+            first, last = numpy.searchsorted(
+                keys, numpy.array([start, end], dtype=numpy.uint64)).tolist()
+        else:
+            first, last = bisect_left(keys, start), bisect_left(keys, end)
+        get_section = self.elffile.get_section
+        return [get_section(sections[k]).get_relocation(numbers[k])
+                for k in range(first, last)]
 
 
 class RelocationHandler(object):
@@ -95,90 +273,177 @@ class RelocationHandler(object):
     """
     def __init__(self, elffile):
         self.elffile = elffile
+        # Values of the symbols of the symbol tables used by relocations,
+        # keyed by section index. Decoded in bulk when first needed
+        self._symbol_values = {}
 
     def find_relocations_for_section(self, section):
         """ Given a section, find the relocation section for it in the ELF
             file. Return a RelocationSection object, or None if none was
             found.
         """
-        reloc_section_names = (
-                '.rel' + section.name,
-                '.rela' + section.name)
-        # Find the relocation section aimed at this one. Currently assume
-        # that either .rel or .rela section exists for this section, but
-        # not both.
-        for relsection in self.elffile.iter_sections():
-            if (    isinstance(relsection, RelocationSection) and
-                    relsection.name in reloc_section_names):
-                return relsection
-        return None
+        # Currently assume that there's a single relocation section for
+        # this section.
+        n = self.elffile._section_index(section)
+        if n is None:
+            return None
+        reloc_sections = self.elffile.get_relocation_sections(n)
+        return reloc_sections[0] if reloc_sections else None
         
     def apply_section_relocations(self, stream, reloc_section):
         """ Apply all relocations in reloc_section (a RelocationSection object)
             to the given stream, that contains the data of the section that is
             being relocated. The stream is modified as a result.
         """
-        # The symbol table associated with this relocation section
-        symtab = self.elffile.get_section(reloc_section['sh_link'])
-        for reloc in reloc_section.iter_relocations():
-            self._do_apply_relocation(stream, reloc, symtab)
-
-    def _do_apply_relocation(self, stream, reloc, symtab):
-        # Preparations for performing the relocation: obtain the value of
-        # the symbol mentioned in the relocation, as well as the relocation
-        # recipe which tells us how to actually perform it.
-        # All peppered with some sanity checking.
-        if reloc['r_info_sym'] >= symtab.num_symbols():
-            raise ELFRelocationError(
-                'Invalid symbol reference in relocation: index %s' % (
-                    reloc['r_info_sym']))
-        sym_value = symtab.get_symbol(reloc['r_info_sym'])['st_value']
-
-        reloc_type = reloc['r_info_type']
-        recipe = None
-
-        if self.elffile.get_machine_arch() == 'x86':
-            if reloc.is_RELA():
+        # The relocations are decoded in bulk and applied to a copy of the
+        # data, in a pass for each relocation type. Symbol values come from a
+        # cached array of the values of the symbol table.
+        arrays = reloc_section.as_arrays()
+        if arrays.num_relocations == 0:
+            return
+        recipes = self._get_recipes(reloc_section.is_RELA())
+        sym_values = self._get_symbol_values(reloc_section['sh_link'])
+
+        if arrays.use_numpy:
+            bad_symbols = arrays.r_info_sym >= len(sym_values)
+            if bad_symbols.any():
+                self._invalid_symbol(
+                    arrays.r_info_sym[bad_symbols.argmax()])
+            reloc_types = numpy.unique(arrays.r_info_type).tolist()
+        else:
+            for sym in arrays.r_info_sym:
+                if sym >= len(sym_values):
+                    self._invalid_symbol(sym)
+            reloc_types = sorted(set(arrays.r_info_type))
+        for reloc_type in reloc_types:
+            if reloc_type not in recipes:
+                raise ELFRelocationError(
+                    'Unsupported relocation type: %s' % reloc_type)
+
+        stream.seek(0)
+        data = stream.read()
+        relocated = None
+        if arrays.use_numpy:
+            relocated = self._apply_numpy(data, arrays, recipes, reloc_types,
+                                          sym_values)
+        if relocated is None:
+            if arrays.use_numpy:
+                # Overlapping relocations are applied one by one, in order
+                arrays = reloc_section.as_arrays(use_numpy=False)
+                sym_values = sym_values.tolist()
+            relocated = self._apply_struct(data, arrays, recipes, sym_values)
+        stream.seek(0)
+        stream.write(relocated)
+
+    #------ PRIVATE ------#
+
+    def _get_recipes(self, is_RELA):
+        """ The recipes for the relocations of a section of the file,
+            keyed by relocation type
+        """
+        arch = self.elffile.get_machine_arch()
+        if arch == 'x86':
+            if is_RELA:
                 raise ELFRelocationError(
-                    'Unexpected RELA relocation for x86: %s' % reloc)
-            recipe = self._RELOCATION_RECIPES_X86.get(reloc_type, None)
-        elif self.elffile.get_machine_arch() == 'x64':
-            if not reloc.is_RELA():
+                    'Unexpected RELA relocation section for x86')
+            return self._RELOCATION_RECIPES_X86
+        elif arch == 'x64':
+            if not is_RELA:
                 raise ELFRelocationError(
-                    'Unexpected REL relocation for x64: %s' % reloc)
-            recipe = self._RELOCATION_RECIPES_X64.get(reloc_type, None)
+                    'Unexpected REL relocation section for x64')
+            return self._RELOCATION_RECIPES_X64
+        return {}
 
-        if recipe is None:
-            raise ELFRelocationError(
-                    'Unsupported relocation type: %s' % reloc_type)
+    def _get_symbol_values(self, symtab_index):
+        """ The values of the symbols of a symbol table, given its section
+            index. A NumPy array of 64-bit values, or a list
+        """
+        values = self._symbol_values.get(symtab_index)
+        if values is None:
+            symtab = self.elffile.get_section(symtab_index)
+            values = symtab.as_arrays().st_value
+            if numpy is not None:
+                values = numpy.asarray(values, dtype=numpy.uint64)
+            self._symbol_values[symtab_index] = values
+        return values
 
-        # So now we have everything we need to actually perform the relocation.
-        # Let's get to it:
+    def _invalid_symbol(self, sym):
+        raise ELFRelocationError(
+            'Invalid symbol reference in relocation: index %s' % sym)
 
-        # 0. Find out which struct we're going to be using to read this value
-        #    from the stream and write it back.
-        if recipe.bytesize == 4:
-            value_struct = self.elffile.structs.Elf_word('')
-        elif recipe.bytesize == 8:
-            value_struct = self.elffile.structs.Elf_word64('')
-        else:
-            raise ELFRelocationError('Invalid bytesize %s for relocation' % 
-                    recipe_bytesize)
-
-        # 1. Read the value from the stream (with correct size and endianness)
-        original_value = struct_parse(
-            value_struct,
-            stream,
-            stream_pos=reloc['r_offset'])
-        # 2. Apply the relocation to the value, acting according to the recipe
-        relocated_value = recipe.calc_func(
-            value=original_value,
-            sym_value=sym_value,
-            offset=reloc['r_offset'],
-            addend=reloc['r_addend'] if recipe.has_addend else 0)
-        # 3. Write the relocated value back into the stream
-        stream.seek(reloc['r_offset'])
-        value_struct.build_stream(relocated_value, stream)
+    def _invalid_offset(self, offset):
+        raise ELFRelocationError(
+            'Relocation offset %s out of the section' % offset)
+
+    def _apply_struct(self, data, arrays, recipes, sym_values):
+        """ Apply the relocations (RelocationArrays with lists) to data, a
+            string, one by one with the struct module. Return the relocated
+            data
+        """
+        data = bytearray(data)
+        byteorder = self.elffile.structs.byteorder
+        value_structs = {4: struct.Struct(byteorder + 'I'),
+                         8: struct.Struct(byteorder + 'Q')}
+        addends = arrays.r_addend or [0] * arrays.num_relocations
+        for offset, sym, reloc_type, addend in zip(
+                arrays.r_offset, arrays.r_info_sym, arrays.r_info_type,
+                addends):
+            recipe = recipes[reloc_type]
+            if offset + recipe.bytesize > len(data):
+                self._invalid_offset(offset)
+            value_struct = value_structs[recipe.bytesize]
+            value = recipe.calc_func(
+                value=value_struct.unpack_from(data, offset)[0],
+                sym_value=sym_values[sym],
+                offset=offset,
+                addend=addend if recipe.has_addend else 0)
+            # Truncated to the size of the relocated value
+            value_struct.pack_into(data, offset,
+                                   value & ((1 << (recipe.bytesize * 8)) - 1))
+        return str(data)
+
+    def _apply_numpy(self, data, arrays, recipes, reloc_types, sym_values):
+        """ Apply the relocations (RelocationArrays with NumPy arrays) to
+            data, a string, in a vectorized pass for each relocation type.
+            Return the relocated data, or None if relocations overlap, as
+            they can't be applied out of order then.
+        """
+        offsets = arrays.r_offset.astype(numpy.int64)
+        sizes = numpy.zeros(arrays.num_relocations, dtype=numpy.int64)
+        for reloc_type in reloc_types:
+            sizes[arrays.r_info_type == reloc_type] = \
+                recipes[reloc_type].bytesize
+        ends = offsets + sizes
+        if ends.max() > len(data):
+            self._invalid_offset(offsets[ends.argmax()])
+        order = numpy.argsort(offsets, kind='mergesort')
+        if (offsets[order][1:] < ends[order][:-1]).any():
+            return None
+
+        buf = numpy.frombuffer(data, dtype=numpy.uint8).copy()
+        byteorder = self.elffile.structs.byteorder
+        if arrays.r_addend is not None:
+            addends = arrays.r_addend.astype(numpy.uint64)
+        for reloc_type in reloc_types:
+            recipe = recipes[reloc_type]
+            selected = arrays.r_info_type == reloc_type
+            type_offsets = offsets[selected]
+            # The bytes of each relocated value, a row per relocation
+            positions = (type_offsets[:, None] +
+                         numpy.arange(recipe.bytesize, dtype=numpy.int64))
+            value_dtype = numpy.dtype('%su%d' % (byteorder, recipe.bytesize))
+            values = buf[positions].view(value_dtype).ravel()
+            # Computed on 64 bits, wrapping around, then truncated
+            relocated = recipe.calc_func(
+                value=values.astype(numpy.uint64),
+                sym_value=sym_values[
+                    arrays.r_info_sym[selected].astype(numpy.int64)],
+                offset=type_offsets.astype(numpy.uint64),
+                addend=(addends[selected] if recipe.has_addend
+                        else numpy.uint64(0)))
+            buf[positions] = relocated.astype(value_dtype).view(
+                numpy.uint8).reshape(positions.shape)
+        return buf.tobytes()
 
     # Relocations are represented by "recipes". Each recipe specifies:
     #  bytesize: The number of bytes to read (and write back) to the section.
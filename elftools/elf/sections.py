@@ -6,8 +6,18 @@
 # Eli Bendersky (eliben@gmail.com)
 # This code is in the public domain
 #-------------------------------------------------------------------------------
-from ..construct import CString
-from ..common.utils import struct_parse, elf_assert
+import mmap
+import struct
+
+from ..common.utils import struct_parse, elf_assert, stream_view
+from .enums import (
+    ENUM_ST_INFO_BIND, ENUM_ST_INFO_TYPE, ENUM_ST_VISIBILITY, ENUM_ST_SHNDX)
+
+# NumPy is optional. When available, SymbolArrays columns are NumPy arrays
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Section(object):
@@ -24,10 +34,10 @@ class Section(object):
         self.stream = stream
     
     def data(self):
-        """ The section data from the file.
+        """ The section data from the file. When the file is memory-mapped
+            this is a zero-copy view over the mapping.
         """
-        self.stream.seek(self['sh_offset'])
-        return self.stream.read(self['sh_size'])
+        return stream_view(self.stream, self['sh_offset'], self['sh_size'])
 
     def is_null(self):
         """ Is this a null section?
@@ -56,17 +66,54 @@ class NullSection(Section):
 class StringTableSection(Section):
     """ ELF string table section.
     """
+    # Maximum number of strings kept in the offset cache
+    _MAX_CACHED_STRINGS = 1 << 16
+
     def __init__(self, header, name, stream):
         super(StringTableSection, self).__init__(header, name, stream)
+        # The table contents and its bounds in it, loaded on first use
+        self._table = None
+        # Strings already looked up, keyed by offset
+        self._string_cache = {}
         
     def get_string(self, offset):
         """ Get the string stored at the given offset in this string table.
         """
-        table_offset = self['sh_offset']
-        return struct_parse(
-            CString(''),
-            self.stream,
-            stream_pos=table_offset + offset)
+        string = self._string_cache.get(offset)
+        if string is None:
+            table, start, end = self._get_table()
+            string = _cstring_at(table, start + offset, end)
+            if len(self._string_cache) >= self._MAX_CACHED_STRINGS:
+                self._string_cache.clear()
+            self._string_cache[offset] = string
+        return string
+
+    def get_strings(self, offsets):
+        """ Get a list with the strings stored at each of the given offsets.
+            Cheaper than calling get_string for each offset when there are
+            many of them, such as the names of all the symbols of a table.
+        """
+        table, start, end = self._get_table()
+        if start != 0 or end != len(table):
+            # Take the table out of the mapping, in a single copy
+            table = table[start:end]
+        return [_cstring_at(table, offset, len(table)) for offset in offsets]
+
+    def _get_table(self):
+        """ Return (table, start, end): an object holding the data of the
+            string table (which supports find and slicing), and the bounds of
+            the data in it.
+            A mapped file is searched in place. Otherwise the section data is
+            read once.
+        """
+        if self._table is None:
+            if isinstance(self.stream, mmap.mmap):
+                start = self['sh_offset']
+                self._table = (self.stream, start, start + self['sh_size'])
+            else:
+                data = self.data()
+                self._table = (data, 0, len(data))
+        return self._table
 
 
 class SymbolTableSection(Section):
@@ -107,6 +154,222 @@ class SymbolTableSection(Section):
         for i in range(self.num_symbols()):
             yield self.get_symbol(i)
 
+    def as_arrays(self, use_numpy=None):
+        """ Decode the whole table in one pass into a SymbolArrays object.
+            NumPy arrays are used if use_numpy is True, or if it's None and
+            NumPy is available. Otherwise the columns are lists.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        return SymbolArrays(self, use_numpy)
+
+    def _address_ranges(self, types, section):
+        """ Address ranges of the symbols of the given types, for the
+            Symbolizer. Return a list of (start, end, (self, n)) tuples.
+            If section (an index) is not None only symbols defined in this
+            section are included. Undefined and common symbols never are.
+        """
+        arrays = self.as_arrays()
+        type_values = [ENUM_ST_INFO_TYPE[stype] for stype in types]
+        excluded = (ENUM_ST_SHNDX['SHN_UNDEF'], ENUM_ST_SHNDX['SHN_COMMON'])
+        if arrays.use_numpy:
+            mask = numpy.in1d(arrays.type, type_values)
+            for shndx in excluded:
+                mask &= arrays.st_shndx != shndx
+            if section is not None:
+                mask &= arrays.st_shndx == section
+            nums = numpy.flatnonzero(mask).tolist()
+            values = arrays.st_value.tolist()
+            sizes = arrays.st_size.tolist()
+        else:
+            nums = [n for n in range(arrays.num_symbols)
+                    if arrays.type[n] in type_values and
+                       arrays.st_shndx[n] not in excluded and
+                       (section is None or arrays.st_shndx[n] == section)]
+            values = arrays.st_value
+            sizes = arrays.st_size
+        # Symbols with no size cover only their own address
+        return [(values[n], values[n] + max(sizes[n], 1), (self, n))
+                for n in nums]
+
+    def _range_symbol(self, n):
+        """ Symbol of an address range of _address_ranges
+        """
+        return self.get_symbol(n)
+
+
+class SymbolArrays(object):
+    """ Columnar representation of a symbol table section. Each column holds
+        one field for every symbol of the table, indexed by symbol number.
+
+        Accessible attributes:
+
+            st_name, st_value, st_size, st_shndx:
+                The raw entry fields. st_name holds offsets into the string
+                table, and st_shndx holds section indexes (special indexes
+                such as SHN_ABS are kept numeric)
+
+            bind, type, visibility:
+                The numeric fields packed in st_info and st_other
+
+        The select method does (vectorized, with NumPy) filtering.
+    """
+    def __init__(self, symtab, use_numpy):
+        self.symtab = symtab
+        self.use_numpy = use_numpy
+        self.num_symbols = symtab.num_symbols()
+
+        columns = decode_entries(
+            symtab.data(), symtab.elfstructs.Elf_Sym_fields,
+            symtab.elfstructs.byteorder, symtab['sh_entsize'],
+            self.num_symbols, use_numpy)
+
+        st_info = columns.pop('st_info')
+        st_other = columns.pop('st_other')
+        for name, column in columns.items():
+            setattr(self, name, column)
+        if use_numpy:
+            self.bind = st_info >> 4
+            self.type = st_info & 0xf
+            self.visibility = st_other & 0x7
+        else:
+            self.bind = [info >> 4 for info in st_info]
+            self.type = [info & 0xf for info in st_info]
+            self.visibility = [other & 0x7 for other in st_other]
+
+    def get_name(self, n):
+        """ Get the name of symbol #n from the associated string table
+        """
+        return self.symtab.stringtable.get_string(self.st_name[n])
+
+    def get_names(self):
+        """ Get the names of all the symbols, in one pass over the string
+            table
+        """
+        st_name = self.st_name
+        if self.use_numpy:
+            st_name = st_name.tolist()
+        return self.symtab.stringtable.get_strings(st_name)
+
+    def select(self, bind=None, stype=None, visibility=None, shndx=None):
+        """ Return the indexes of the symbols matching all the given
+            criteria, in increasing order. Criteria left as None are ignored.
+
+            bind, stype and visibility can be given by name (for example
+            'STB_GLOBAL') or numerically. shndx can be a section index, a
+            special index name (such as 'SHN_UNDEF'), or a section name.
+
+            For example, all global functions in .text:
+            > arrays.select(bind='STB_GLOBAL', stype='STT_FUNC', shndx='.text')
+        """
+        criteria = []
+        if bind is not None:
+            criteria.append((self.bind, _enum_value(ENUM_ST_INFO_BIND, bind)))
+        if stype is not None:
+            criteria.append((self.type, _enum_value(ENUM_ST_INFO_TYPE, stype)))
+        if visibility is not None:
+            criteria.append((self.visibility,
+                _enum_value(ENUM_ST_VISIBILITY, visibility)))
+        if shndx is not None:
+            criteria.append((self.st_shndx, self._section_index(shndx)))
+
+        if self.use_numpy:
+            mask = numpy.ones(self.num_symbols, dtype=bool)
+            for column, value in criteria:
+                mask &= column == value
+            return numpy.flatnonzero(mask)
+        indexes = range(self.num_symbols)
+        for column, value in criteria:
+            indexes = [i for i in indexes if column[i] == value]
+        return indexes
+
+    #------ PRIVATE ------#
+
+    def _section_index(self, shndx):
+        """ Resolve a section index, special index name or section name to
+            a section index
+        """
+        if not isinstance(shndx, str):
+            return shndx
+        if shndx in ENUM_ST_SHNDX:
+            return ENUM_ST_SHNDX[shndx]
+        elffile = self.symtab.elffile
+        elf_assert(elffile.get_section_by_name(shndx) is not None,
+                'Unknown section %s' % shndx)
+        return elffile._section_name_map[shndx]
+
+
+# Number of entries decoded per struct call by the pure Python decoder
+_CHUNK = 4096
+
+
+def decode_entries(data, fields, byteorder, entsize, count, use_numpy):
+    """ Decode count entries of entsize bytes from data into columns.
+        fields lists the fields of an entry in order, as (name, format)
+        pairs where format is a struct module format character. Return a
+        dict mapping each field name to its column: a NumPy array if
+        use_numpy is True, a list otherwise.
+    """
+    if use_numpy:
+        return _decode_numpy(data, fields, byteorder, entsize, count)
+    return _decode_struct(data, fields, byteorder, entsize, count)
+
+
+def _decode_numpy(data, fields, byteorder, entsize, count):
+    """ Decode all the entries with a single structured NumPy dtype
+    """
+    offsets = []
+    offset = 0
+    for _, fmt in fields:
+        offsets.append(offset)
+        offset += struct.calcsize('=' + fmt)
+    dtype = numpy.dtype(dict(
+        names=[name for name, _ in fields],
+        formats=[byteorder + fmt for _, fmt in fields],
+        offsets=offsets,
+        itemsize=entsize))
+    entries = numpy.frombuffer(data, dtype=dtype, count=count)
+    return dict((name, entries[name].astype(fmt)) for name, fmt in fields)
+
+
+def _decode_struct(data, fields, byteorder, entsize, count):
+    """ Decode all the entries with the struct module, a chunk of entries
+        per call, and split the flat result into columns.
+    """
+    entry_format = ''.join(fmt for _, fmt in fields)
+    padding = entsize - struct.calcsize('=' + entry_format)
+    entry_format += 'x' * padding
+    nfields = len(fields)
+
+    columns = dict((name, []) for name, _ in fields)
+    chunk_struct = struct.Struct(byteorder + entry_format * _CHUNK)
+    for start in range(0, count, _CHUNK):
+        n = min(_CHUNK, count - start)
+        if n == _CHUNK:
+            unpacker = chunk_struct
+        else:
+            unpacker = struct.Struct(byteorder + entry_format * n)
+        flat = unpacker.unpack_from(data, start * entsize)
+        for i, (name, _) in enumerate(fields):
+            columns[name].extend(flat[i::nfields])
+    return columns
+
+
+def _cstring_at(table, offset, end):
+    """ The null-terminated string at offset in table, without the
+        terminating null. The string is cut at end if it has no terminator.
+    """
+    stop = table.find('\0', offset, end)
+    if stop == -1:
+        stop = end
+    return table[offset:stop]
+
+
+def _enum_value(enum, value):
+    """ Numeric value of an enum entry given by name or by value
+    """
+    return enum[value] if isinstance(value, str) else value
+
 
 class Symbol(object):
     """ Symbol object - representing a single symbol entry from a symbol table
@@ -7,6 +7,12 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 
+import struct
+import weakref
+from array import array
+from bisect import bisect_right, insort
+from itertools import islice, izip
+
 from ..construct import Container
 from ..common.utils import struct_parse
 from enums import *
@@ -15,7 +21,14 @@ from .sections import (
     StringTableSection, SymbolTableSection, Symbol)
 
 class StringTableSectionEdit(StringTableSection):
-    """ ELF editable string table section. """
+    """ ELF editable string table section.
+
+    The table is built as a list of chunks, joined only when its contents
+    are needed. Strings are looked up in a dict of the strings in the table,
+    and in a sorted list of the reversed strings, which finds a string
+    holding the new one as a suffix (tail merging: 'bar' is found in 'foobar').
+    Both are built on the first addition.
+    """
     def __init__(self, elffile, string_table_section=None, name='.strtab'):
         self.marker = "\0\0__%MaRkeR$"
         self.marked = False
@@ -24,7 +37,8 @@ class StringTableSectionEdit(StringTableSection):
 
         if string_table_section:
             self.header = string_table_section.header
-            self.table = string_table_section.data()
+            # Only the editable tables are copied out of a mapped file
+            self.table = str(string_table_section.data())
             self.name = string_table_section.name
         else:
             self.header = self._build_header()
@@ -33,12 +47,32 @@ class StringTableSectionEdit(StringTableSection):
             
         # Should start with a null char
         if len(self.table) == 0:
-            self.table += '\0'
+            self.table = '\0'
+
+    def _get_table_data(self):
+        """ The table contents, joining the chunks added since the last call """
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0]
+
+    def _set_table_data(self, table):
+        """ Replace the table contents, dropping the string indexes """
+        self._chunks = [table]
+        self._size = len(table)
+        self._offsets = None
+        self._reversed = None
+
+    table = property(_get_table_data, _set_table_data)
 
     def get_string(self, offset):
         """ Get the string stored at the given offset in this string table.
         """
-        return self.table[offset:self.table.find('\0', offset)]
+        table = self.table
+        return table[offset:table.find('\0', offset)]
+
+    def _get_table(self):
+        """ The table being edited, for get_strings """
+        return self.table, 0, self._size
 
     def controlled(self):
         """ Tell stringtable that it's under control, it means it can erase anything
@@ -49,29 +83,58 @@ class StringTableSectionEdit(StringTableSection):
         self.marked = False
         off = self.table.find(self.marker+'\0')
         if off == -1:
-            off = len(self.table)
-        self.table = self.table[0:off]
+            off = self._size
+        else:
+            self.table = self.table[0:off]
         return off
 
     def add_string(self, s):
         """ Add a string to the table and return it's offset.
         If the string is already inplace it will use it.
+        Use add_strings to add many strings at once.
         """
-        off = self.table.find(s+'\0')
-        if off == -1:
-            if self.control and not self.marked:
-                self.table += self.marker + '\0'
-                self.marked = True
-            off = len(self.table)
-            self.table += s + '\0'
+        off = self.find_string(s)
+        if off is None:
+            off = self._append([s])[0]
+            # Keep the index of reversed strings sorted
+            insort(self._reversed, s[::-1])
+            self._offsets[s] = off
+        return off
+
+    def find_string(self, s):
+        """ Get the offset of s in the table, as a string or as the tail of
+        one, or None if it's not in the table. The table isn't changed.
+        """
+        offsets = self._get_offsets()
+        off = offsets.get(s)
+        if off is None:
+            off = self._find_suffix_offset(s)
+            if off is not None:
+                offsets[s] = off
         return off
 
+    def add_strings(self, strings):
+        """ Add the strings to the table and return the list of their offsets.
+        Strings already in the table, or that are the tail of a string in the
+        table or of another string of the list, are not added again.
+        """
+        offsets = self._get_offsets()
+        new = []
+        seen = set()
+        for s in strings:
+            if s not in offsets and s not in seen:
+                seen.add(s)
+                new.append(s)
+        if new:
+            self._add_new_strings(new)
+        return [offsets[s] for s in strings]
+
     def fix_header(self, offset):
         """ Make the string table consistent for saving.
         Receives it's offset and returns the offset of it's end
         """
         self.header['sh_offset'] = offset
-        self.header['sh_size'] = len(self.table)
+        self.header['sh_size'] = self._size
         return offset + self['sh_size']
 
     def data(self):
@@ -80,6 +143,96 @@ class StringTableSectionEdit(StringTableSection):
         """
         return self.table
 
+    def _get_offsets(self):
+        """ Get the dict mapping each string of the table to its offset,
+        building it (and the index of reversed strings) if needed
+        """
+        if self._offsets is None:
+            offsets = {}
+            off = 0
+            # The last piece isn't null terminated, so it's not a string
+            for string in self.table.split('\0')[:-1]:
+                offsets.setdefault(string, off)
+                off += len(string) + 1
+            self._offsets = offsets
+            self._reversed = sorted(string[::-1] for string in offsets)
+        return self._offsets
+
+    def _find_suffix(self, s, reversed_strings=None):
+        """ Find a string ending with s in the table (or, if given, in the
+        sorted list reversed_strings) and return the string, or None.
+        Strings starting with s reversed follow it in the sorted list.
+        """
+        if reversed_strings is None:
+            reversed_strings = self._reversed
+        rs = s[::-1]
+        # s itself may be in the list, skip it
+        i = bisect_right(reversed_strings, rs)
+        if i < len(reversed_strings) and reversed_strings[i].startswith(rs):
+            return reversed_strings[i][::-1]
+        return None
+
+    def _find_suffix_offset(self, s):
+        """ Offset of s as the tail of a string of the table, or None """
+        host = self._find_suffix(s)
+        if host is None:
+            return None
+        return self._offsets[host] + len(host) - len(s)
+
+    def _add_new_strings(self, new):
+        """ Add strings that aren't in the table yet. Tails of strings of
+        the table, or of other new strings, are merged into them.
+        """
+        offsets = self._offsets
+        # Sorting the old and new reversed strings together puts each string
+        # right before one it's the tail of, if there's any.
+        # Merging two sorted runs is linear.
+        new_reversed = set(s[::-1] for s in new)
+        merged = sorted(self._reversed + sorted(new_reversed))
+        # The string each new string is the tail of, if any
+        hosts = {}
+        for rs, next_rs in izip(merged, islice(merged, 1, None)):
+            if next_rs.startswith(rs) and rs in new_reversed:
+                hosts[rs[::-1]] = next_rs[::-1]
+        # Before appending, which may add the string of the marker to it
+        self._reversed = merged
+
+        appended = [s for s in new if s not in hosts]
+        for s, off in zip(appended, self._append(appended)):
+            offsets[s] = off
+        for s in hosts:
+            # Follow the chain of hosts up to a string with an offset
+            chain = []
+            while s not in offsets:
+                chain.append(s)
+                s = hosts[s]
+            for tail in reversed(chain):
+                offsets[tail] = offsets[s] + len(s) - len(tail)
+                s = tail
+
+    def _append(self, strings):
+        """ Append the strings at the end of the table (after the marker,
+        if needed) and return their offsets
+        """
+        if not strings:
+            return []
+        if self.control and not self.marked:
+            marker = self.marker + '\0'
+            # The marker holds a string too, after its two null chars
+            marker_string = self.marker[2:]
+            if marker_string not in self._offsets:
+                self._offsets[marker_string] = self._size + 2
+                insort(self._reversed, marker_string[::-1])
+            self._chunks.append(marker)
+            self._size += len(marker)
+            self.marked = True
+        result = []
+        for s in strings:
+            result.append(self._size)
+            self._chunks.append(s + '\0')
+            self._size += len(s) + 1
+        return result
+
     def _build_header(self):
         """ Builds an empty header """
         return Container(
@@ -96,20 +249,60 @@ class StringTableSectionEdit(StringTableSection):
 
 
 class SymbolTableSectionEdit(SymbolTableSection):
-    """ ELF editable Symbol table section. """
+    """ ELF editable Symbol table section.
+
+    The entries are kept in a SymbolStore, in typed arrays with a row per
+    symbol, and the table is the list of the rows in table order. SymbolEdit
+    objects are views over the rows, created when a symbol is accessed. The
+    same object is returned for a symbol while it's referenced.
 
-    def __init__(self, elffile, symboltable=None, name='.symtab'):
+    If lazy is True the symbols of symboltable are left in its data (see
+    LazySymbolStore), and the list of rows is only built when needed, so
+    loading the table doesn't depend on its size.
+    """
+
+    def __init__(self, elffile, symboltable=None, name='.symtab', lazy=False):
         self.elffile = elffile
         self.elfstructs = self.elffile.structs
-        self.symbols = []
-        self.sec_map = self.elffile.get_section_name_map()
+
+        # Views of the rows, kept only while they are referenced
+        self._views = weakref.WeakValueDictionary()
+
+        # Maps a name to the list of rows with this name, in table order.
+        # Built when first needed
+        self._name_index = None
+
+        # Log of the symbols added, removed or moved, read by Symbolizer.
+        # When the log grows too big it's dropped and the generation
+        # changes, telling readers to start over.
+        self._changes = []
+        self._changes_generation = 0
+
+        # Rows changed since the table was loaded or saved, and whether
+        # symbols were added or removed since then, for ELFFileEdit.patch
+        self._modified = set()
+        self._reordered = False
+        # Maps a row to its index in the table, built when needed
+        self._positions = None
+        # Maps a row to a number giving its place in the table, which stays
+        # valid while symbols are only removed or appended. Built when needed
+        self._ranks = None
+        # Rows removed by name but still in the list of rows, which is
+        # compacted when next needed
+        self._tombstones = set()
+        # The mapping of the file (section name to index) and its reverse,
+        # built by _section_name
+        self._section_names = None
 
         if not symboltable:
             self.header = self._build_header()
             self.name = name
+            self._store = SymbolStore(self.elffile.elfclass)
+            self._store.symtab = self
+            self._order = array('I')
             
             # Create default 0 Entry
-            self.symbols.append(SymbolEdit(
+            self.add_symbol(SymbolEdit(
                 name='\0',
                 value=0,
                 bind='STB_LOCAL', 
@@ -122,11 +315,19 @@ class SymbolTableSectionEdit(SymbolTableSection):
             # Copy information/symbols from original table
             self.name = symboltable.name
             self.header = symboltable.header
-            if symboltable['sh_size'] > 0:
-                for sym in symboltable.iter_symbols():
-                    syme = SymbolEdit(symbol=sym)
-                    syme.install_section(self.sec_map)
-                    self.symbols.append(syme)
+            if lazy:
+                self._store = LazySymbolStore(self.elffile.elfclass,
+                                              symboltable)
+                # The table starts with the rows of the section
+                self._order = array('I')
+                self._file_prefix = self._store.num_file_rows
+            else:
+                self._store = SymbolStore(self.elffile.elfclass,
+                                          symboltable.stringtable)
+                if symboltable['sh_size'] > 0:
+                    self._store.extend(symboltable.as_arrays())
+                self._order = array('I', xrange(len(self._store)))
+            self._store.symtab = self
 
     def fix_header(self, offset):
         """ Make the symbol table consistent for saving.
@@ -143,76 +344,472 @@ class SymbolTableSectionEdit(SymbolTableSection):
                 self.header['sh_link'] = i
                 break
             
-        # Local symbols must be showed first (stable sort)
-        self.symbols.sort(
-            key=lambda sym: \
-                0 if sym.entry['st_info']['bind'] == 'STB_LOCAL' \
-                else 1)
+        # Local symbols must be showed first (stable partition)
+        local, others = self._partition(self._order)
+        if local + others != self._order:
+            self._order = local + others
+            # The name index must follow the new order
+            self._name_index = None
+            self._positions = None
         
         # sh_info should contain the index of the first
         # non local symbol
-        self.header['sh_info'] = 0
-        for sym in self.symbols:
-            if sym.entry['st_info']['bind'] != 'STB_LOCAL':
-                break
-            self.header['sh_info'] += 1
+        self.header['sh_info'] = len(local)
         
-        # Force creation of the mapping: section name to index 
-        self.elffile.get_section_by_name('') 
-        # Install the section in every symbol
-
-        for sym in self.symbols:
-            sym.install_section(self.sec_map)
+        # Install the section of the symbols whose section was set
+        self._store.install_sections(self._section_map())
 
         self._push_symbols_names(self.elffile.get_section_by_name('.strtab'))
 
         return offset + self.header['sh_size']
 
     def add_symbol(self, sym):
-        """ Add a symbol object to the end of the table """
-        
-        self.symbols.append(sym)
+        """ Add a symbol object to the end of the table.
+        The symbol object becomes a view of the new entry.
+        """
+        row = self._store.add(sym)
+        self._views[row] = sym
+        # Appending doesn't need the whole list of rows
+        self._rows.append(row)
+        if self._name_index is not None:
+            self._name_index.setdefault(sym.name, []).append(row)
+        if self._ranks is not None:
+            self._ranks[row] = len(self._ranks)
+        self._reordered = True
+        self._positions = None
+        self._symbol_changed(sym)
     
     def num_symbols(self):
         """ Number of symbols in the table """
-        return len(self.symbols)
+        return self._file_prefix + len(self._rows) - len(self._tombstones)
         
     def get_symbol(self, n):
         """ Get the symbol at index #n from the table (Symbol object) """
-        return self.symbols[n]
+        if self._tombstones:
+            return self._view(self._order[n])
+        if 0 <= n < self._file_prefix:
+            return self._view(n)
+        if n >= self._file_prefix:
+            return self._view(self._rows[n - self._file_prefix])
+        return self._view(self._order[n])
 
     def get_symbol_by_name(self, name):
         """ Get the symbol with name=name from the table (Symbol object) """
-        for sym in self.symbols:
-            if sym.name == name:
-                return sym
+        rows = self._get_name_index().get(name)
+        if rows:
+            return self._view(rows[0])
+
+    def get_symbols_by_name(self, name):
+        """ Get all the symbols with name=name, in table order """
+        return [self._view(row)
+                for row in self._get_name_index().get(name, ())]
 
     def remove_symbol(self, n):
         """ Remove symbol given an index, indexes are refreshed after each use """
         assert n > 0
-        return self.symbols.pop(n)
+        return self._remove_row(self._order.pop(n))
 
     def remove_symbol_by_name(self, name):
         """ Remove symbol given a name """
-        for i, sym in enumerate(self.symbols[1:]):
-            if sym.name == name:
-                return self.remove_symbol(i+1)
+        first_row = self._first_row()
+        for row in self._get_name_index().get(name, ()):
+            # The symbol at index 0 can't be removed
+            if row != first_row:
+                # Left in the list of rows until it's compacted, so removing
+                # many symbols doesn't go over the table for each one
+                self._tombstones.add(row)
+                return self._remove_row(row)
+
+    def apply_symbol_changes(self, adds=(), removes=(), renames=()):
+        """ Apply many changes to the table at once, in a single pass over
+        it instead of one per change.
+        adds: symbols to add at the end of the table
+        removes: symbols to remove, given as symbols, as indexes (before the
+            changes) or as names (the first symbol with the name not removed
+            yet, names not found are ignored)
+        renames: (symbol or name, new name) pairs, or a dict (a name
+            gives the first symbol with the name not removed or renamed yet)
+        Local symbols are moved before the global ones, as done when saving.
+        Returns the list of removed symbols.
+        """
+        if isinstance(renames, dict):
+            renames = renames.items()
+        store = self._store
+        name_index = self._get_name_index()
+        # Resolve names and indexes against the table before the changes
+        removed = set()
+        taken = {}
+        for r in removes:
+            if isinstance(r, basestring):
+                rows = name_index.get(r, ())
+                i = taken.get(r, 0)
+                while i < len(rows) and (rows[i] == self._order[0] or
+                                         rows[i] in removed):
+                    i += 1
+                taken[r] = i + 1
+                if i == len(rows):
+                    continue
+                row = rows[i]
+            elif isinstance(r, (int, long)):
+                row = self._order[r]
+            else:
+                assert r.symtab is self
+                row = r._row
+            assert row != self._order[0]
+            removed.add(row)
+        renamed = []
+        taken = {}
+        for sym, name in renames:
+            if isinstance(sym, basestring):
+                # The first symbol with the name not removed or renamed yet
+                rows = name_index.get(sym, ())
+                i = taken.get(sym, 0)
+                while i < len(rows) and rows[i] in removed:
+                    i += 1
+                taken[sym] = i + 1
+                if i == len(rows):
+                    continue
+                row = rows[i]
+            else:
+                assert sym.symtab is self
+                row = sym._row
+            if row not in removed:
+                renamed.append((row, name))
+
+        added = []
+        for sym in adds:
+            row = store.add(sym)
+            self._views[row] = sym
+            added.append(row)
+        if added or removed:
+            # Single compaction pass, keeping local symbols first
+            local, others = self._partition(
+                [row for row in self._order if row not in removed] + added)
+            self._order = local + others
+            self.header['sh_info'] = len(local)
+            store.removed.update(removed)
+            self._name_index = None
+            self._reordered = True
+            self._positions = None
+
+        removed = [self._view(row) for row in removed]
+        for sym in removed:
+            self._symbol_changed(sym)
+        for row in added:
+            self._symbol_changed(self._view(row))
+        # Renames alone don't change the order, like set_name
+        for row, name in renamed:
+            self._rename_symbol(self._view(row), name)
+        return removed
 
     def data(self):
-        """ Get the binary representation of the symbol table """
-        d = ''
-        for sym in self.symbols:
-            sym.install_section(self.elffile._section_name_map)
-            d += self.elfstructs.Elf_Sym.build(sym.entry)
+        """ Get the binary representation of the symbol table
+        The entries are packed with a precompiled struct into a single
+        preallocated bytearray. Entries of a lazy table that weren't
+        changed are copied from the file.
+        """
+        entry_struct = self._entry_struct()
+        d = bytearray(entry_struct.size * self.num_symbols())
+
+        self._store.install_sections(self._section_map())
+        self._store.write_entries(d, self._order, entry_struct,
+                                  self.elffile.elfclass == 64)
         return d
 
+    def modified_entries(self):
+        """ Get the binary representation of the entries of the symbols
+        changed since the table was loaded or saved. Returns a list of
+        (index, data) tuples sorted by index, consecutive entries are joined.
+        Symbols must not have been added or removed.
+        """
+        assert not self._reordered
+        positions = self._get_positions()
+        pack = self._entry_struct().pack
+        entry_values = self._store.entry_values
+        elf64 = self.elffile.elfclass == 64
+
+        self._store.install_sections(self._section_map())
+        entries = []
+        for i in sorted(positions[row] for row in self._modified):
+            data = pack(*entry_values(self._order[i], elf64))
+            if entries and entries[-1][0] + entries[-1][2] == i:
+                entries[-1][1].append(data)
+                entries[-1][2] += 1
+            else:
+                entries.append([i, [data], 1])
+        return [(i, ''.join(data)) for i, data, _ in entries]
+
+    def modified_symbols(self):
+        """ Get the symbols changed since the table was loaded or saved """
+        return [self._view(row) for row in self._modified]
+
+    def push_modified_names(self, string_table):
+        """ Save the names of the symbols renamed since the table was loaded
+        or saved in a string table, without taking control of it. Names
+        already in the table are reused
+        """
+        store = self._store
+        rows = [row for row in self._modified if store.st_name[row] == 0]
+        names = string_table.add_strings([store.get_name(row) for row in rows])
+        for row, name_offset in izip(rows, names):
+            store.st_name[row] = name_offset
+
+    def local_symbols_moved(self):
+        """ Check if a changed symbol must move between the local and the
+        global symbols, which changes the order of the table
+        """
+        positions = self._get_positions()
+        st_info = self._store.st_info
+        for row in self._modified:
+            local = positions[row] < self['sh_info']
+            if local != (st_info[row] >> 4 == ENUM_ST_INFO_BIND['STB_LOCAL']):
+                return True
+        return False
+
+    def saved(self):
+        """ Tell the table its symbols were written to the file """
+        self._modified = set()
+        self._reordered = False
+
+    # Maximum length of the change log
+    _MAX_CHANGES = 4096
+
+    def _symbol_changed(self, sym):
+        """ Log a change of a symbol. Called by the table and by the
+        SymbolEdit setters
+        """
+        if len(self._changes) >= self._MAX_CHANGES:
+            self._changes = []
+            self._changes_generation += 1
+        self._changes.append(sym)
+        self._modified.add(sym._row)
+
+    def _remove_row(self, row):
+        """ Remove the symbol at row, already taken out of the list of rows
+        or marked as a tombstone. Returns the symbol
+        """
+        sym = self._view(row)
+        if self._name_index is not None:
+            self._unindex_row(row, sym.name)
+        self._store.removed.add(row)
+        self._reordered = True
+        self._positions = None
+        self._symbol_changed(sym)
+        return sym
+
+    def _first_row(self):
+        """ The row of the symbol at index 0, without compacting the list of
+        rows (it can't be removed)
+        """
+        if self._file_prefix:
+            return 0
+        return self._rows[0]
+
+    def _view(self, row):
+        """ The SymbolEdit object for a row """
+        sym = self._views.get(row)
+        if sym is None:
+            sym = self._views[row] = SymbolEdit._view(self._store, row)
+        return sym
+
+    def _partition(self, rows):
+        """ Split rows into the local and the other symbols, keeping their
+        order. Returns two arrays
+        """
+        is_local = self._store.is_local
+        local = array('I')
+        others = array('I')
+        for row in rows:
+            if is_local(row):
+                local.append(row)
+            else:
+                others.append(row)
+        return local, others
+
+    def _get_order(self):
+        """ Get the array of the rows in table order, building it if the
+        table still starts with the rows of the section of a lazy table,
+        and taking out the rows removed by name
+        """
+        if self._file_prefix:
+            order = array('I', xrange(self._file_prefix))
+            order.extend(self._rows)
+            self._rows = order
+            self._file_prefix = 0
+        if self._tombstones:
+            tombstones = self._tombstones
+            self._rows = array('I', [row for row in self._rows
+                                     if row not in tombstones])
+            self._tombstones = set()
+        return self._rows
+
+    def _set_order(self, order):
+        self._rows = order
+        self._file_prefix = 0
+        self._tombstones = set()
+        self._ranks = None
+
+    # The rows in table order. A lazy table keeps the number of leading rows
+    # of the section in _file_prefix and the following rows in _rows
+    _order = property(_get_order, _set_order)
+    _file_prefix = 0
+
+    def _get_positions(self):
+        """ Get the dict mapping rows to their index in the table """
+        if self._positions is None:
+            self._positions = dict(izip(self._order, xrange(len(self._order))))
+        return self._positions
+
+    def _get_ranks(self):
+        """ Get the dict mapping rows to a number giving their place in the
+        table. Unlike the positions, it's kept when symbols are removed or
+        appended
+        """
+        if self._ranks is None:
+            self._ranks = dict(izip(self._order, xrange(len(self._order))))
+        return self._ranks
+
+    def _entry_struct(self):
+        """ Precompiled struct for the symbol entries """
+        structs = self.elfstructs
+        return struct.Struct(structs.byteorder +
+            ''.join(fmt for _, fmt in structs.Elf_Sym_fields))
+
+    def _address_ranges(self, types, section):
+        """ Address ranges of the symbols of the given types, for the
+        Symbolizer. Return a list of (start, end, (self, row)) tuples.
+        """
+        store = self._store
+        type_values = set(ENUM_ST_INFO_TYPE.get(t, t) for t in types)
+        excluded = (ENUM_ST_SHNDX['SHN_UNDEF'], ENUM_ST_SHNDX['SHN_COMMON'])
+        st_info = store.st_info
+        st_value = store.st_value
+        st_size = store.st_size
+        ranges = []
+        for row in self._order:
+            if st_info[row] & 0xf not in type_values:
+                continue
+            shndx = store.get_shndx(row, self._section_index)
+            if shndx in excluded or shndx is None:
+                continue
+            if section is not None and shndx != section:
+                continue
+            # Symbols with no size cover only their own address
+            start = st_value[row]
+            ranges.append((start, start + max(st_size[row], 1), (self, row)))
+        return ranges
+
+    def _range_symbol(self, row):
+        """ Symbol of an address range of _address_ranges """
+        return self._view(row)
+
+    def _range_owner(self, sym):
+        """ Owner of the address range of sym in _address_ranges """
+        return (self, sym._row)
+
+    def _symbol_address_range(self, sym, types, section):
+        """ Address range (start, end) of a symbol, or None if the symbol is
+        not one of the given types or not defined in section (an index, or
+        None for any section)
+        """
+        if sym.get_type() not in types:
+            return None
+        shndx = sym._store.get_shndx(sym._row, self._section_index)
+        if shndx in (ENUM_ST_SHNDX['SHN_UNDEF'], ENUM_ST_SHNDX['SHN_COMMON'],
+                     None):
+            return None
+        if section is not None and shndx != section:
+            return None
+        # Symbols with no size cover only their own address
+        return (sym.get_value(), sym.get_value() + max(sym.get_size(), 1))
+
+    def _section_index(self, sname):
+        """ Index of the section named sname, or None """
+        return self._section_map().get(sname)
+
+    def _section_map(self):
+        """ The mapping of the file: section name to index """
+        # Force creation of the mapping
+        self.elffile.get_section_by_name('')
+        return self.elffile._section_name_map
+
+    def _section_name(self, shndx):
+        """ Name of the section at index shndx (a number), or None if it's
+        a special index. The reverse of the mapping of the file is built
+        once for each mapping
+        """
+        if shndx in _ST_SHNDX_NAMES:
+            return None
+        section_map = self._section_map()
+        if self._section_names is None or \
+                self._section_names[0] is not section_map:
+            names = dict((i, name) for name, i in section_map.iteritems())
+            self._section_names = (section_map, names)
+        return self._section_names[1].get(shndx)
+
+    def _get_name_index(self):
+        """ Get the name index, building it if needed """
+        if self._name_index is None:
+            name_index = {}
+            names = self._store.get_names(self._order)
+            for row, name in izip(self._order, names):
+                name_index.setdefault(name, []).append(row)
+            self._name_index = name_index
+        return self._name_index
+
+    def _rename_symbol(self, sym, name):
+        """ Rename sym, updating the name index. Called by SymbolEdit.set_name
+        """
+        row = sym._row
+        old_name = sym.name
+        self._store.names[row] = name
+        # The name will be pushed to the string table again
+        self._store.st_name[row] = 0
+        self._symbol_changed(sym)
+        if self._name_index is None:
+            return
+        self._unindex_row(row, old_name)
+        rows = self._name_index.setdefault(name, [])
+        if rows:
+            # Keep the list in table order (only happens for duplicate names)
+            ranks = self._get_ranks()
+            rank = ranks[row]
+            i = len(rows)
+            while i > 0 and ranks[rows[i-1]] > rank:
+                i -= 1
+            rows.insert(i, row)
+        else:
+            rows.append(row)
+
+    def _unindex_row(self, row, name):
+        """ Remove a row from the name index, under name """
+        rows = self._name_index[name]
+        rows.remove(row)
+        if not rows:
+            del self._name_index[name]
+
+    def _symbol_index(self, sym):
+        """ Index of sym in the table, sym must be in it """
+        return self._order.index(sym._row)
+
     def _push_symbols_names(self, string_table):
         """ Save the symbol names in a string table """
+        store = self._store
+        st_name = store.st_name
         off = string_table.controlled()
-        for sym in self.symbols:
-            # Only update the name for created or controlled symbols
-            if sym['st_name'] == 0 or sym['st_name'] >= off:
-                sym.entry['st_name'] = string_table.add_string(sym.name)
+        # Only update the name for created or controlled symbols
+        order = self._order
+        rows = [row for row, name_offset
+                in izip(order, store.name_offsets(order))
+                if name_offset == 0 or name_offset >= off]
+        names = store.get_names(rows)
+        offsets = string_table.add_strings(names)
+        for row, name, name_offset in izip(rows, names, offsets):
+            # Unchanged entries of a lazy table are left in the file
+            if st_name[row] != name_offset:
+                st_name[row] = name_offset
+            # The offset isn't in the original string table anymore
+            store.names[row] = name
 
     def _build_header(self):
         """ Builds an empty header """
@@ -228,88 +825,663 @@ class SymbolTableSectionEdit(SymbolTableSection):
             sh_addralign = self.elffile.elfclass/8,
             sh_entsize = self.elfstructs.Elf_Sym.sizeof())
 
+
+class SymbolStore(object):
+    """ Compact storage of symbol entries, in parallel typed arrays holding
+    a field of every symbol (a row). Rows are only appended, so a row number
+    identifies a symbol for as long as the store lives.
+
+    Fields are kept numerically, as in the file: st_info and st_other as
+    bytes (only the visibility of st_other is kept). Names are read from the
+    string table at st_name, unless set in names (created, renamed or saved
+    symbols). Section names set in snames are installed in st_shndx by
+    install_sections, which resolves each name once. The rows are then
+    stable: sections are only added after the ones of the file, so their
+    indexes don't change.
+
+    Accessible attributes:
+
+        st_name, st_value, st_size, st_info, st_other, st_shndx:
+            The columns
+
+        names, snames:
+            dicts mapping rows to their name or section name
+
+        uninstalled:
+            The rows whose section name isn't installed in st_shndx yet
+
+        removed:
+            The rows removed from the table using the store
+
+        symtab:
+            The table using the store, None for the store of a symbol not in
+            a table
+    """
+    def __init__(self, elfclass=64, stringtable=None):
+        self.stringtable = stringtable
+        self.st_name = array('I')
+        self.st_value = _word_array(elfclass)
+        self.st_size = _word_array(elfclass)
+        self.st_info = array('B')
+        self.st_other = array('B')
+        self.st_shndx = array('H')
+        self.names = {}
+        self.snames = {}
+        self.uninstalled = set()
+        self.removed = set()
+        self.symtab = None
+
+    def __len__(self):
+        return len(self.st_name)
+
+    def append(self, st_name, st_value, st_size, st_info, st_other, st_shndx):
+        """ Add a row and return it """
+        self.st_name.append(st_name)
+        self.st_value.append(st_value)
+        self.st_size.append(st_size)
+        self.st_info.append(st_info)
+        self.st_other.append(st_other)
+        self.st_shndx.append(st_shndx)
+        return len(self.st_name) - 1
+
+    def extend(self, arrays):
+        """ Add the rows of a SymbolArrays object """
+        if arrays.use_numpy:
+            st_info = (arrays.bind << 4 | arrays.type).tolist()
+        else:
+            st_info = [bind << 4 | stype
+                       for bind, stype in izip(arrays.bind, arrays.type)]
+        self.st_name.extend(_to_list(arrays.st_name))
+        self.st_value.extend(_to_list(arrays.st_value))
+        self.st_size.extend(_to_list(arrays.st_size))
+        self.st_info.extend(st_info)
+        self.st_other.extend(_to_list(arrays.visibility))
+        self.st_shndx.extend(_to_list(arrays.st_shndx))
+
+    def add(self, sym):
+        """ Copy the entry of sym to a new row, and make sym a view of it.
+        Returns the row
+        """
+        store, row = sym._store, sym._row
+        name = sym.name
+        new_row = self.append(0, store.st_value[row], store.st_size[row],
+            store.st_info[row], store.st_other[row], store.st_shndx[row])
+        # The name will be pushed to the string table of this store
+        self.names[new_row] = name
+        if row in store.snames:
+            self.set_sname(new_row, store.snames[row])
+        elif store is not self and store.symtab is not None:
+            # The section index is the one in the file of the other table,
+            # the section is found here by its name
+            sname = store.symtab._section_name(store.st_shndx[row])
+            if sname is not None:
+                self.set_sname(new_row, sname)
+        sym._store, sym._row = self, new_row
+        return new_row
+
+    def get_name(self, row):
+        """ Name of the symbol at row """
+        name = self.names.get(row)
+        if name is None:
+            name = self.stringtable.get_string(self.st_name[row])
+        return name
+
+    def get_names(self, rows):
+        """ Names of the symbols at rows, in one pass over the string table
+        """
+        names = self.names
+        read = [row for row in rows if row not in names]
+        if read:
+            strings = self.stringtable.get_strings(self.name_offsets(read))
+            found = dict(izip(read, strings))
+        else:
+            found = {}
+        return [names[row] if row in names else found[row] for row in rows]
+
+    def name_offsets(self, rows):
+        """ st_name of the symbols at rows, in a list """
+        st_name = self.st_name
+        return [st_name[row] for row in rows]
+
+    def set_sname(self, row, sname):
+        """ Set the section name of the symbol at row, installed in
+        st_shndx by install_sections
+        """
+        self.snames[row] = sname
+        self.uninstalled.add(row)
+
+    def get_shndx(self, row, section_index):
+        """ Section index of the symbol at row. If it has a section name
+        that's not installed yet, it's resolved with section_index
+        """
+        shndx = self.st_shndx[row]
+        if row in self.uninstalled and shndx != ENUM_ST_SHNDX['SHN_ABS']:
+            sname = self.snames[row]
+            if sname is None:
+                return ENUM_ST_SHNDX['SHN_UNDEF']
+            return section_index(sname)
+        return shndx
+
+    def install_section(self, row, section_map):
+        """ Update the section index of the symbol at row, if it has a
+        section name. section_map maps names to indexes, and a None name
+        maps to SHN_UNDEF
+        """
+        if row not in self.snames:
+            return
+        self.uninstalled.discard(row)
+        if self.st_shndx[row] == ENUM_ST_SHNDX['SHN_ABS']:
+            return
+        sname = self.snames[row]
+        if sname is None:
+            self.st_shndx[row] = ENUM_ST_SHNDX['SHN_UNDEF']
+        else:
+            self.st_shndx[row] = section_map[sname]
+
+    def install_sections(self, section_map):
+        """ install_section for every symbol whose section name isn't
+        installed yet. Each name is looked up once
+        """
+        snames = self.snames
+        st_shndx = self.st_shndx
+        indexes = {None: ENUM_ST_SHNDX['SHN_UNDEF']}
+        for row in self.uninstalled:
+            if row in self.removed or \
+                    st_shndx[row] == ENUM_ST_SHNDX['SHN_ABS']:
+                continue
+            sname = snames[row]
+            shndx = indexes.get(sname)
+            if shndx is None:
+                shndx = indexes[sname] = section_map[sname]
+            st_shndx[row] = shndx
+        self.uninstalled = set()
+
+    def entry_values(self, row, elf64):
+        """ Values of the entry at row, in the order of the fields of
+        Elf_Sym
+        """
+        if elf64:
+            return (self.st_name[row], self.st_info[row], self.st_other[row],
+                    self.st_shndx[row], self.st_value[row], self.st_size[row])
+        return (self.st_name[row], self.st_value[row], self.st_size[row],
+                self.st_info[row], self.st_other[row], self.st_shndx[row])
+
+    def is_local(self, row):
+        """ Is the symbol at row local? """
+        return self.st_info[row] >> 4 == ENUM_ST_INFO_BIND['STB_LOCAL']
+
+    def write_entries(self, data, rows, entry_struct, elf64):
+        """ Pack the entries of rows, in order, into the bytearray data """
+        pack_into = entry_struct.pack_into
+        entsize = entry_struct.size
+        entry_values = self.entry_values
+        for i, row in enumerate(rows):
+            pack_into(data, i * entsize, *entry_values(row, elf64))
+
+
+class LazySymbolStore(SymbolStore):
+    """ SymbolStore over the entries of a symbol table section of a file.
+    Its symbols are the first rows, read from the section data when needed,
+    which is a view over the file when it's mapped. A row is copied out of
+    the data (materialized) when one of its fields is set, rows added later
+    are kept in arrays as in SymbolStore.
+
+    Accessible attributes, besides the ones of SymbolStore:
+
+        num_file_rows:
+            Number of rows read from the section
+
+        loaded:
+            dict mapping the materialized rows to the list of their fields,
+            in the order of the columns
+    """
+    # The columns, in the order of the fields of the lists of loaded
+    _COLUMNS = ('st_name', 'st_value', 'st_size',
+                'st_info', 'st_other', 'st_shndx')
+
+    def __init__(self, elfclass, symboltable):
+        super(LazySymbolStore, self).__init__(elfclass,
+                                              symboltable.stringtable)
+        structs = symboltable.elfstructs
+        fields = [name for name, _ in structs.Elf_Sym_fields]
+        self._entry = struct.Struct(structs.byteorder +
+            ''.join(fmt for _, fmt in structs.Elf_Sym_fields))
+        # Position of each column in the unpacked entries
+        self._fields = [fields.index(name) for name in self._COLUMNS]
+        # The section header is shared with the editable table, so
+        # everything needed from it is read now
+        self._data = symboltable.data()
+        self._entsize = symboltable['sh_entsize']
+        self._byteorder = structs.byteorder
+        # st_name of the rows read from the section, decoded when the
+        # names of many rows are needed
+        self._file_st_name = None
+        self.num_file_rows = symboltable.num_symbols()
+        # Symbols before sh_info are the local ones
+        self._num_file_locals = symboltable['sh_info']
+        self.loaded = {}
+        for i, name in enumerate(self._COLUMNS):
+            setattr(self, name, _LazyColumn(self, i, getattr(self, name)))
+
+    def read_entry(self, row):
+        """ Fields of a row read from the section, in the order of the
+        columns. The list is only kept if the row is materialized
+        """
+        entry = self.loaded.get(row)
+        if entry is None:
+            values = self._entry.unpack_from(self._data, row * self._entsize)
+            entry = [values[i] for i in self._fields]
+            # Only the visibility of st_other is kept
+            entry[4] &= 0x7
+        return entry
+
+    def materialize(self, row):
+        """ Copy a row read from the section out of the data, and return
+        the list of its fields
+        """
+        entry = self.loaded.get(row)
+        if entry is None:
+            entry = self.loaded[row] = self.read_entry(row)
+        return entry
+
+    def is_raw(self, row):
+        """ Is the row still the entry in the section data? """
+        return row < self.num_file_rows and row not in self.loaded
+
+    def name_offsets(self, rows):
+        """ st_name of the symbols at rows, in a list. st_name of the rows
+        still in the section data is decoded in bulk, once
+        """
+        if self._file_st_name is None:
+            self._file_st_name = self._decode_st_name()
+        file_st_name = self._file_st_name
+        loaded = self.loaded
+        num_file_rows = self.num_file_rows
+        st_name = self.st_name
+        return [file_st_name[row]
+                if row < num_file_rows and row not in loaded
+                else st_name[row] for row in rows]
+
+    def is_local(self, row):
+        """ Is the symbol at row local? """
+        if self.is_raw(row):
+            return row < self._num_file_locals
+        return super(LazySymbolStore, self).is_local(row)
+
+    def write_entries(self, data, rows, entry_struct, elf64):
+        """ Pack the entries of rows, in order, into the bytearray data.
+        Runs of consecutive rows that are still in the section data are
+        copied from it at once
+        """
+        pack_into = entry_struct.pack_into
+        entsize = entry_struct.size
+        assert entsize == self._entsize
+        entry_values = self.entry_values
+        is_raw = self.is_raw
+        file_data = self._data
+        # Current run: first index and first row, and the next row in it
+        start = first = None
+        next_row = -1
+        for i, row in enumerate(rows):
+            if row == next_row and is_raw(row):
+                next_row += 1
+                continue
+            if start is not None:
+                data[start * entsize:i * entsize] = \
+                    file_data[first * entsize:next_row * entsize]
+                start = None
+            if is_raw(row):
+                start, first, next_row = i, row, row + 1
+            else:
+                pack_into(data, i * entsize, *entry_values(row, elf64))
+                next_row = -1
+        if start is not None:
+            data[start * entsize:len(rows) * entsize] = \
+                file_data[first * entsize:next_row * entsize]
+
+
+    # Number of entries decoded per struct call by _decode_st_name
+    _CHUNK = 4096
+
+    def _decode_st_name(self):
+        """ st_name of every row of the section, in an array. st_name is
+        the first field of the entries, the others are skipped
+        """
+        entsize = self._entsize
+        entry_format = 'I%dx' % (entsize - 4)
+        st_name = array('I')
+        chunk_struct = struct.Struct(
+            self._byteorder + entry_format * self._CHUNK)
+        for start in xrange(0, self.num_file_rows, self._CHUNK):
+            count = min(self._CHUNK, self.num_file_rows - start)
+            if count == self._CHUNK:
+                unpacker = chunk_struct
+            else:
+                unpacker = struct.Struct(self._byteorder + entry_format * count)
+            st_name.extend(unpacker.unpack_from(self._data, start * entsize))
+        return st_name
+
+
+class _LazyColumn(object):
+    """ A column of a LazySymbolStore. The rows read from the section are
+    looked up in the store, the rows added later are in values
+    """
+    def __init__(self, store, field, values):
+        self.store = store
+        self.field = field
+        self.values = values
+
+    def __len__(self):
+        return self.store.num_file_rows + len(self.values)
+
+    def __getitem__(self, row):
+        num_file_rows = self.store.num_file_rows
+        if row >= num_file_rows:
+            return self.values[row - num_file_rows]
+        return self.store.read_entry(row)[self.field]
+
+    def __setitem__(self, row, value):
+        num_file_rows = self.store.num_file_rows
+        if row >= num_file_rows:
+            self.values[row - num_file_rows] = value
+        else:
+            self.store.materialize(row)[self.field] = value
+
+    def append(self, value):
+        self.values.append(value)
+
+
+def _word_array(elfclass):
+    """ An array for addresses and sizes of the given class. A list is used
+    if the platform has no 64 bits array type
+    """
+    if elfclass == 32:
+        return array('I')
+    if array('L').itemsize >= 8:
+        return array('L')
+    return []
+
+
+def _to_list(column):
+    """ A column of a SymbolArrays object as a list """
+    if isinstance(column, list):
+        return column
+    return column.tolist()
+
+
+def _reverse_enum(enum):
+    """ Map the values of an enum dict to their names """
+    return dict((value, name) for name, value in enum.iteritems()
+                if name != '_default_')
+
+_ST_BIND_NAMES = _reverse_enum(ENUM_ST_INFO_BIND)
+_ST_TYPE_NAMES = _reverse_enum(ENUM_ST_INFO_TYPE)
+_ST_VISIBILITY_NAMES = _reverse_enum(ENUM_ST_VISIBILITY)
+_ST_SHNDX_NAMES = _reverse_enum(ENUM_ST_SHNDX)
+
+# The fields of the entries of 64-bit files, in order, for the symbols not in
+# a table
+_ELF64_SYM_FIELDS = (
+    ('st_name', 'I'), ('st_info', 'B'), ('st_other', 'B'),
+    ('st_shndx', 'H'), ('st_value', 'Q'), ('st_size', 'Q'))
+
+
+class SymbolBatch(object):
+    """ Collects changes to a symbol table, applied at once with
+    SymbolTableSectionEdit.apply_symbol_changes when leaving a with block
+    (unless an exception was raised) or when apply() is called.
+    Indexes and names refer to the table before the changes.
+    """
+    def __init__(self, symtab):
+        self.symtab = symtab
+        self.adds = []
+        self.removes = []
+        self.renames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    def create_symbol(self, name='', value=0, bind='STB_GLOBAL', \
+                          stype='STT_FUNC', sname='.text', size=0, \
+                          visibility='STV_DEFAULT'):
+        """ Create a new symbol to be added, see ELFFileEdit.create_symbol
+        Returns a reference to the symbol
+        """
+        sym = SymbolEdit(name, value, bind, stype, sname, size, visibility)
+        self.adds.append(sym)
+        return sym
+
+    def add_symbol(self, sym):
+        """ Add a symbol object to the table """
+        self.adds.append(sym)
+
+    def remove_symbol(self, n):
+        """ Remove a symbol given an index or a symbol object """
+        self.removes.append(n)
+
+    def remove_symbol_by_name(self, name):
+        """ Remove a symbol given it's name """
+        self.removes.append(name)
+
+    def rename_symbol(self, sym, name):
+        """ Rename a symbol, given as a symbol object or by it's name """
+        self.renames.append((sym, name))
+
+    def apply(self):
+        """ Apply the collected changes and return the removed symbols """
+        removed = self.symtab.apply_symbol_changes(
+            self.adds, self.removes, self.renames)
+        self.adds = []
+        self.removes = []
+        self.renames = []
+        return removed
+
+
+class _EntryContainer(Container):
+    """ Container of the fields of a symbol entry, calling set_field(name,
+    value) when a field is set
+    """
+    __slots__ = ['_set_field']
+
+    def __init__(self, set_field, *fields):
+        """ fields: the (name, value) pairs of the fields, in order """
+        Container.__init__(self)
+        object.__setattr__(self, '_set_field', set_field)
+        for name, value in fields:
+            Container.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        # Container.__repr__ sets a recursion lock attribute
+        if not name.startswith('__'):
+            self._set_field(name, value)
+        Container.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return repr(self._to_container())
+
+    def __pretty_str__(self, nesting=1, indentation='    '):
+        # Printed as the entry of a symbol read from a file
+        return self._to_container().__pretty_str__(nesting, indentation)
+
+    def _to_container(self):
+        """ A plain Container with the same fields """
+        container = Container()
+        for name in self.__attrs__:
+            value = self.__dict__[name]
+            if isinstance(value, _EntryContainer):
+                value = value._to_container()
+            container[name] = value
+        return container
+
+
 class SymbolEdit(Symbol):
     """ Symbol Edit object - representing a single symbol entry from a symbol table
         section.
 
         Similarly to Symbol but add editting functionality
 
-        Should be editted through the setters and getters.
+        Should be editted through the setters and getters. The entry is
+        kept in a SymbolStore: the symbols of a table are views over its
+        store, and a symbol not in a table has a store of its own. entry
+        builds a Container of the entry, whose fields are written through
+        to the symbol when set.
     """
     def __init__(self, name='', value=0, bind='STB_GLOBAL', stype='STT_FUNC', sname='.text', size=0, visibility='STV_DEFAULT', symbol=None):
+        self._store = SymbolStore()
         if symbol != None:
-            self.sname = -1
-            self.entry = symbol.entry
-            self.name = symbol.name
+            entry = symbol.entry
+            st_info = entry['st_info']
+            bind = st_info['bind']
+            stype = st_info['type']
+            visibility = entry['st_other']['visibility']
+            shndx = entry['st_shndx']
+            self._row = self._store.append(entry['st_name'],
+                entry['st_value'], entry['st_size'],
+                (ENUM_ST_INFO_BIND.get(bind, bind) << 4 |
+                 ENUM_ST_INFO_TYPE.get(stype, stype)),
+                ENUM_ST_VISIBILITY.get(visibility, visibility),
+                ENUM_ST_SHNDX.get(shndx, shndx))
+            self._store.names[self._row] = symbol.name
             return
 
+        self._row = self._store.append(0, 0, 0, 0, 0, 0)
         self.set_name(name)
-        self.entry = self._build_entry()
         self.set_bind(bind)
         self.set_type(stype)
         self.set_visibility(visibility)
         self.set_section(sname)
         self.set_value(value)
         self.set_size(size)
-                
+
+    @classmethod
+    def _view(cls, store, row):
+        """ Create a symbol object for a row of a store """
+        sym = cls.__new__(cls)
+        sym._store = store
+        sym._row = row
+        return sym
 
     def __str__(self):
         return ('%s (%s): %s\n') % (self.name, self.sname, self.entry)
 
+    def __getitem__(self, name):
+        """ Implement dict-like access to entries
+        """
+        return self.entry[name]
+
+    @property
+    def symtab(self):
+        """ Symbol table holding this symbol, or None """
+        if self._row in self._store.removed:
+            return None
+        return self._store.symtab
+
+    @property
+    def entry(self):
+        """ The entry, as read from a file. Setting its fields (including
+        the ones of st_info and st_other) changes the symbol
+        """
+        store, row = self._store, self._row
+        shndx = int(store.st_shndx[row])
+        set_field = self._set_entry_field
+        fields = dict(
+            st_name = int(store.st_name[row]),
+            st_info = _EntryContainer(set_field,
+                ('bind', self.get_bind()), ('type', self.get_type())),
+            st_other = _EntryContainer(set_field,
+                ('visibility', self.get_visibility())),
+            st_shndx = _ST_SHNDX_NAMES.get(shndx, shndx),
+            st_value = int(store.st_value[row]),
+            st_size = int(store.st_size[row]))
+        # The fields in the order of the file
+        if store.symtab is not None:
+            order = store.symtab.elfstructs.Elf_Sym_fields
+        else:
+            order = _ELF64_SYM_FIELDS
+        return _EntryContainer(set_field,
+            *[(name, fields[name]) for name, _ in order])
+
+    @property
+    def sname(self):
+        """ Section name of the symbol: the one set, or else the name of the
+        section at the index in the entry for a symbol of a table. -1 if the
+        section is only known by the index in the entry
+        """
+        store, row = self._store, self._row
+        if row in store.snames:
+            return store.snames[row]
+        if store.symtab is not None:
+            sname = store.symtab._section_name(store.st_shndx[row])
+            if sname is not None:
+                return sname
+        return -1
+
     def install_section(self, section_map):
         """ Update the index of the referenced section.
         It receives a dictionary mapping names to indexes.
         If name equals to None it will map to SHN_UNDEF.
         """
-        if self.entry['st_shndx'] == 'SHN_ABS':
-            return
-        if self.sname == None:
-            self.entry['st_shndx'] = 'SHN_UNDEF'
-        elif self.sname != -1:
-            self.entry['st_shndx'] = section_map[self.sname]
-        else:
-            for k,v in section_map.items():
-                if v == self.entry['st_shndx']:
-                    self.set_section(k)
+        self._store.install_section(self._row, section_map)
         
     def set_name(self, name):
         """ Change Symbol name """
-        self.name = name
+        symtab = self.symtab
+        if symtab is not None and self.name != name:
+            symtab._rename_symbol(self, name)
+        else:
+            self._store.names[self._row] = name
 
     def get_name(self):
         """ Get Symbol name """
-        return self.name
+        return self._store.get_name(self._row)
+
+    name = property(get_name, set_name)
 
     def set_bind(self, bind):
         """ Set binding, refer to ENUM_ST_INFO_BIND """
         assert bind in ENUM_ST_INFO_BIND
-        self.entry['st_info']['bind'] = bind
+        st_info = self._store.st_info
+        st_info[self._row] = (ENUM_ST_INFO_BIND[bind] << 4 |
+                              st_info[self._row] & 0xf)
+        self._changed()
         
     def get_bind(self):
         """ Get binding, refer to ENUM_ST_INFO_BIND """
-        return self.entry['st_info']['bind']
+        bind = self._store.st_info[self._row] >> 4
+        return _ST_BIND_NAMES.get(bind, bind)
 
     def set_type(self, stype):
         """ Set type, refer to ENUM_ST_INFO_TYPE """
         assert stype in ENUM_ST_INFO_TYPE
-        self.entry['st_info']['type'] = stype
+        st_info = self._store.st_info
+        st_info[self._row] = (st_info[self._row] & 0xf0 |
+                              ENUM_ST_INFO_TYPE[stype])
+        self._changed()
 
     def get_type(self):
         """ Get type, refer to ENUM_ST_INFO_TYPE """
-        return self.entry['st_info']['type']
+        stype = self._store.st_info[self._row] & 0xf
+        return _ST_TYPE_NAMES.get(stype, stype)
 
     def set_visibility(self, vis):
         """ Set visibility, refer to ENUM_ST_VISIBILITY """
         assert vis in ENUM_ST_VISIBILITY
-        self.entry['st_other']['visibility'] = vis
+        self._store.st_other[self._row] = ENUM_ST_VISIBILITY[vis]
+        self._changed()
     
     def get_visibility(self):
         """ Get visibility, refer to ENUM_ST_VISIBILITY """
-        return self.entry['st_other']['visibility']
+        vis = self._store.st_other[self._row]
+        return _ST_VISIBILITY_NAMES.get(vis, vis)
     
     def set_section(self, sname):
         """ Set the section name referenced by the symbol """
-        self.sname = sname
+        self._store.set_sname(self._row, sname)
+        self._changed()
 
     def get_section(self):
         """ Get the section name referenced by the symbol """
@@ -317,31 +1489,56 @@ class SymbolEdit(Symbol):
         
     def set_value(self, value):
         """ Set value """
-        self.entry['st_value'] = value
+        self._store.st_value[self._row] = value
+        self._changed()
 
     def get_value(self):
         """ Get value """
-        return self.entry['st_value']
+        return self._store.st_value[self._row]
 
     def set_size(self, size):
         """ Set size """
-        self.entry['st_size'] = size
+        self._store.st_size[self._row] = size
+        self._changed()
 
     def get_size(self):
         """ Get size """
-        return self.entry['st_size']
+        return self._store.st_size[self._row]
         
-    def _build_entry(self):
-        """ Builds a default empty entry
-        Uses STB_GLOBAL, STT_FUNC, STV_DEFAULT and SHN_UNDEF
+    def _set_entry_field(self, name, value):
+        """ Set a field of the entry (or of st_info and st_other), for the
+        Containers of entry
         """
-        st_info_container = Container(bind = 'STB_GLOBAL')
-        st_info_container.type = 'STT_FUNC'
-        return Container(
-            st_name = 0,
-            st_info = st_info_container,
-            st_other = Container(visibility = 'STV_DEFAULT'),
-            st_shndx = 'SHN_UNDEF',
-            st_value = 0,
-            st_size = 0)
+        if name == 'st_name':
+            self._store.st_name[self._row] = value
+            self._changed()
+        elif name == 'st_value':
+            self.set_value(value)
+        elif name == 'st_size':
+            self.set_size(value)
+        elif name == 'st_shndx':
+            # The index replaces the section name set, if any
+            store, row = self._store, self._row
+            store.snames.pop(row, None)
+            store.uninstalled.discard(row)
+            store.st_shndx[row] = ENUM_ST_SHNDX.get(value, value)
+            self._changed()
+        elif name == 'st_info':
+            self.set_bind(value['bind'])
+            self.set_type(value['type'])
+        elif name == 'bind':
+            self.set_bind(value)
+        elif name == 'type':
+            self.set_type(value)
+        elif name == 'st_other':
+            self.set_visibility(value['visibility'])
+        elif name == 'visibility':
+            self.set_visibility(value)
+        else:
+            raise AttributeError('Symbol entries have no field %s' % name)
 
+    def _changed(self):
+        """ Tell the table holding the symbol that it changed """
+        symtab = self.symtab
+        if symtab is not None:
+            symtab._symbol_changed(self)
@@ -7,7 +7,7 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 from ..construct import CString
-from ..common.utils import struct_parse
+from ..common.utils import struct_parse, stream_view
 from .constants import SH_FLAGS
 
 
@@ -17,10 +17,10 @@ class Segment(object):
         self.stream = stream
     
     def data(self):
-        """ The segment data from the file.
+        """ The segment data from the file. When the file is memory-mapped
+            this is a zero-copy view over the mapping.
         """
-        self.stream.seek(self['p_offset'])
-        return self.stream.read(self['p_filesz'])
+        return stream_view(self.stream, self['p_offset'], self['p_filesz'])
 
     def __getitem__(self, name):
         """ Implement dict-like access to header entries
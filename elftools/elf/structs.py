@@ -13,6 +13,7 @@ from ..construct import (
     SBInt32, SLInt32, SBInt64, SLInt64,
     Struct, Array, Enum, Padding, BitStruct, BitField, Value,
     )
+from ..common.construct_utils import CompiledStruct
 
 from .enums import *
 
@@ -38,6 +39,24 @@ class ELFStructs(object):
 
             Elf_Rel, Elf_Rela:
                 Entries in relocation sections
+
+            The structures above are fixed-size, and compiled into
+            CompiledStruct objects: they parse into the same Containers as
+            the Structs, with a single struct module call, and also decode
+            from a string at an offset with parse_from(data, offset).
+
+            byteorder:
+                '<' or '>', the byte order character of the struct module
+
+            Elf_Sym_fields:
+                The fields of Elf_Sym in order, as (name, format) pairs where
+                format is a struct module format character. st_info and
+                st_other are taken as whole bytes. Used to encode and decode
+                whole symbol tables at once.
+
+            Elf_Rel_fields, Elf_Rela_fields:
+                The fields of Elf_Rel and Elf_Rela in order, as Elf_Sym_fields.
+                r_info is taken whole.
     """
     def __init__(self, little_endian=True, elfclass=32):
         assert elfclass == 32 or elfclass == 64
@@ -45,7 +64,20 @@ class ELFStructs(object):
         self.elfclass = elfclass        
         self._create_structs()
     
+    # Compiled structs, shared by the ELFStructs of the same endianness and
+    # class: keyed by (little_endian, elfclass, struct name)
+    _compiled_structs = {}
+
+    def _compile(self, struct):
+        """ The CompiledStruct of a Struct, compiled once
+        """
+        key = (self.little_endian, self.elfclass, struct.name)
+        if key not in self._compiled_structs:
+            self._compiled_structs[key] = CompiledStruct(struct)
+        return self._compiled_structs[key]
+
     def _create_structs(self):
+        self.byteorder = '<' if self.little_endian else '>'
         if self.little_endian:
             self.Elf_byte = ULInt8
             self.Elf_half = ULInt16
@@ -74,7 +106,7 @@ class ELFStructs(object):
         self._create_rel()
     
     def _create_ehdr(self):
-        self.Elf_Ehdr = Struct('Elf_Ehdr',
+        self.Elf_Ehdr = self._compile(Struct('Elf_Ehdr',
             Struct('e_ident',
                 Array(4, self.Elf_byte('EI_MAG')),
                 Enum(self.Elf_byte('EI_CLASS'), **ENUM_EI_CLASS),
@@ -97,11 +129,11 @@ class ELFStructs(object):
             self.Elf_half('e_shentsize'),
             self.Elf_half('e_shnum'),
             self.Elf_half('e_shstrndx'),
-        )
+        ))
     
     def _create_phdr(self):
         if self.elfclass == 32:
-            self.Elf_Phdr = Struct('Elf_Phdr',
+            self.Elf_Phdr = self._compile(Struct('Elf_Phdr',
                 Enum(self.Elf_word('p_type'), **ENUM_P_TYPE),
                 self.Elf_offset('p_offset'),
                 self.Elf_addr('p_vaddr'),
@@ -110,9 +142,9 @@ class ELFStructs(object):
                 self.Elf_word('p_memsz'),
                 self.Elf_word('p_flags'),
                 self.Elf_word('p_align'),
-            )
+            ))
         else: # 64
-            self.Elf_Phdr = Struct('Elf_Phdr',
+            self.Elf_Phdr = self._compile(Struct('Elf_Phdr',
                 Enum(self.Elf_word('p_type'), **ENUM_P_TYPE),
                 self.Elf_word('p_flags'),
                 self.Elf_offset('p_offset'),
@@ -121,10 +153,10 @@ class ELFStructs(object):
                 self.Elf_xword('p_filesz'),
                 self.Elf_xword('p_memsz'),
                 self.Elf_xword('p_align'),
-            )   
+            ))
         
     def _create_shdr(self):
-        self.Elf_Shdr = Struct('Elf_Shdr',
+        self.Elf_Shdr = self._compile(Struct('Elf_Shdr',
             self.Elf_word('sh_name'),
             Enum(self.Elf_word('sh_type'), **ENUM_SH_TYPE),
             self.Elf_xword('sh_flags'),
@@ -135,35 +167,39 @@ class ELFStructs(object):
             self.Elf_word('sh_info'),
             self.Elf_xword('sh_addralign'),
             self.Elf_xword('sh_entsize'),
-        )
+        ))
     
     def _create_rel(self):
         # r_info is also taken apart into r_info_sym and r_info_type.
         # This is done in Value to avoid endianity issues while parsing.
         if self.elfclass == 32:
+            self.Elf_Rel_fields = (('r_offset', 'I'), ('r_info', 'I'))
+            self.Elf_Rela_fields = self.Elf_Rel_fields + (('r_addend', 'i'),)
             r_info_sym = Value('r_info_sym',
                 lambda ctx: (ctx['r_info'] >> 8) & 0xFFFFFF)
             r_info_type = Value('r_info_type',
                 lambda ctx: ctx['r_info'] & 0xFF)
         else: # 64
+            self.Elf_Rel_fields = (('r_offset', 'Q'), ('r_info', 'Q'))
+            self.Elf_Rela_fields = self.Elf_Rel_fields + (('r_addend', 'q'),)
             r_info_sym = Value('r_info_sym',
                 lambda ctx: (ctx['r_info'] >> 32) & 0xFFFFFFFF)
             r_info_type = Value('r_info_type',
                 lambda ctx: ctx['r_info'] & 0xFFFFFFFF)
 
-        self.Elf_Rel = Struct('Elf_Rel',
+        self.Elf_Rel = self._compile(Struct('Elf_Rel',
             self.Elf_addr('r_offset'),
             self.Elf_xword('r_info'),
             r_info_sym,
             r_info_type,
-        )
-        self.Elf_Rela = Struct('Elf_Rela',
+        ))
+        self.Elf_Rela = self._compile(Struct('Elf_Rela',
             self.Elf_addr('r_offset'),
             self.Elf_xword('r_info'),
             r_info_sym,
             r_info_type,
             self.Elf_sxword('r_addend'),
-        )
+        ))
 
     def _create_sym(self):
         # st_info is hierarchical. To access the type, use
@@ -177,23 +213,29 @@ class ELFStructs(object):
             Padding(5),
             Enum(BitField('visibility', 3), **ENUM_ST_VISIBILITY))
         if self.elfclass == 32:
-            self.Elf_Sym = Struct('Elf_Sym',
+            self.Elf_Sym_fields = (
+                ('st_name', 'I'), ('st_value', 'I'), ('st_size', 'I'),
+                ('st_info', 'B'), ('st_other', 'B'), ('st_shndx', 'H'))
+            self.Elf_Sym = self._compile(Struct('Elf_Sym',
                 self.Elf_word('st_name'),
                 self.Elf_addr('st_value'),
                 self.Elf_word('st_size'),
                 st_info_struct,
                 st_other_struct,
                 Enum(self.Elf_half('st_shndx'), **ENUM_ST_SHNDX),
-            )
+            ))
         else:
-            self.Elf_Sym = Struct('Elf_Sym',
+            self.Elf_Sym_fields = (
+                ('st_name', 'I'), ('st_info', 'B'), ('st_other', 'B'),
+                ('st_shndx', 'H'), ('st_value', 'Q'), ('st_size', 'Q'))
+            self.Elf_Sym = self._compile(Struct('Elf_Sym',
                 self.Elf_word('st_name'),
                 st_info_struct,
                 st_other_struct,
                 Enum(self.Elf_half('st_shndx'), **ENUM_ST_SHNDX),
                 self.Elf_addr('st_value'),
                 self.Elf_xword('st_size'),
-            )
+            ))
 
 
 
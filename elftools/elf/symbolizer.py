@@ -0,0 +1,212 @@
+#-------------------------------------------------------------------------------
+# elftools: elf/symbolizer.py
+#
+# Address to symbol lookups
+#
+# Davi Costa (davialcosta@gmail.com)
+# This code is in the public domain
+#-------------------------------------------------------------------------------
+import heapq
+from bisect import bisect_right
+
+# NumPy is optional. When available, it's used for batch lookups
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SymbolIndex(object):
+    """ Interval index over address ranges. Each range is a (start, end,
+        owner) tuple covering the addresses start <= addr < end.
+
+        When ranges overlap, an address belongs to the innermost range: the
+        one with the highest start, then the lowest end, then the first one
+        given.
+
+        The ranges are flattened into sorted, disjoint segments when the
+        index is created, so a lookup is a single binary search.
+    """
+    def __init__(self, ranges):
+        self.ranges = list(ranges)
+        self._starts, self._owners = self._flatten()
+        if numpy is not None:
+            self._starts_array = numpy.array(self._starts, dtype=numpy.uint64)
+            self._owners_array = numpy.array(self._owners, dtype=numpy.int64)
+
+    def lookup(self, addr):
+        """ Return the number (position in ranges) of the range containing
+            addr, or -1 if there's none.
+        """
+        i = bisect_right(self._starts, addr) - 1
+        return self._owners[i] if i >= 0 else -1
+
+    def lookup_many(self, addrs):
+        """ Like lookup, for a sequence of addresses. Return a list.
+        """
+        if numpy is None or not self._starts:
+            return [self.lookup(addr) for addr in addrs]
+        addrs = numpy.asarray(addrs, dtype=numpy.uint64)
+        pos = numpy.searchsorted(self._starts_array, addrs, side='right') - 1
+        found = self._owners_array[numpy.maximum(pos, 0)]
+        return numpy.where(pos >= 0, found, -1).tolist()
+
+    #------ PRIVATE ------#
+
+    def _flatten(self):
+        """ Split the ranges into disjoint segments. Return the list of segment
+            starts and the range number owning each segment (-1 for gaps).
+        """
+        order = sorted(range(len(self.ranges)),
+                       key=lambda n: self.ranges[n][:2] + (n,))
+        bounds = set()
+        for start, end, _ in self.ranges:
+            bounds.add(start)
+            bounds.add(end)
+
+        starts = []
+        owners = []
+        active = []
+        k = 0
+        for bound in sorted(bounds):
+            while k < len(order) and self.ranges[order[k]][0] == bound:
+                n = order[k]
+                start, end, _ = self.ranges[n]
+                heapq.heappush(active, (-start, end, n))
+                k += 1
+            # Ranges that ended are dropped once they reach the top
+            while active and active[0][1] <= bound:
+                heapq.heappop(active)
+            owner = active[0][2] if active else -1
+            if not owners or owners[-1] != owner:
+                starts.append(bound)
+                owners.append(owner)
+        return starts, owners
+
+
+class Symbolizer(object):
+    """ Maps addresses to the symbols containing them, over all the symbol
+        tables (.symtab and .dynsym) of an ELF file.
+
+        types:
+            Symbol types taken into account
+
+        section:
+            If not None, only symbols defined in the section with this index
+            are taken into account. In relocatable files symbol values are
+            offsets into their sections, so a section should be given.
+
+        A symbol covers [st_value, st_value + st_size). Symbols with no size
+        only cover their own address. Undefined and common symbols are
+        ignored.
+
+        Editable symbol tables log their changes, which are applied to the
+        index as an overlay until there are too many of them.
+    """
+    # Number of changed symbols kept in the overlay before rebuilding
+    _MAX_OVERLAY = 256
+
+    def __init__(self, elffile, types=('STT_FUNC', 'STT_OBJECT'),
+                 section=None):
+        self.elffile = elffile
+        self.types = types
+        self.section = section
+        self._index = None
+
+    def symbolize(self, addr):
+        """ Return the symbol containing addr, or None
+        """
+        self._refresh()
+        n = self._index.lookup(addr)
+        if self._overlay:
+            if n >= 0 and self._index.ranges[n][2] in self._changed_owners:
+                # The symbol found was changed after the index was built
+                self._rebuild()
+                n = self._index.lookup(addr)
+            else:
+                return self._symbolize_with_overlay(addr, n)
+        return self._get_symbol(n)
+
+    def symbolize_many(self, addrs):
+        """ Return a list with the symbol containing each address of addrs
+            (None for addresses without a symbol)
+        """
+        self._refresh()
+        if self._overlay:
+            return [self.symbolize(addr) for addr in addrs]
+        get_symbol = self._get_symbol
+        return [get_symbol(n) for n in self._index.lookup_many(addrs)]
+
+    #------ PRIVATE ------#
+
+    def _symbol_tables(self):
+        return (self.elffile.get_sections_by_type('SHT_SYMTAB') +
+                self.elffile.get_sections_by_type('SHT_DYNSYM'))
+
+    def _refresh(self):
+        """ Build the index if needed, and bring the overlay up to date with
+            the changes logged by editable tables since then
+        """
+        if self._index is None:
+            self._rebuild()
+            return
+        for symtab in self._symbol_tables():
+            changes = getattr(symtab, '_changes', None)
+            if changes is None:
+                continue
+            generation, seen = self._seen_changes.get(id(symtab), (None, 0))
+            if generation != symtab._changes_generation:
+                # The table dropped its log, so changes may have been lost
+                self._rebuild()
+                return
+            for sym in changes[seen:]:
+                self._overlay[sym] = symtab
+                self._changed_owners.add(symtab._range_owner(sym))
+            self._seen_changes[id(symtab)] = (generation, len(changes))
+        if len(self._overlay) > self._MAX_OVERLAY:
+            self._rebuild()
+
+    def _rebuild(self):
+        ranges = []
+        self._seen_changes = {}
+        for symtab in self._symbol_tables():
+            ranges.extend(symtab._address_ranges(self.types, self.section))
+            if getattr(symtab, '_changes', None) is not None:
+                self._seen_changes[id(symtab)] = (
+                    symtab._changes_generation, len(symtab._changes))
+        self._index = SymbolIndex(ranges)
+        self._overlay = {}
+        # Owners in the index of the symbols in the overlay
+        self._changed_owners = set()
+        # Symbol objects, created on demand for tables that hold entries
+        self._symbols = {}
+
+    def _symbolize_with_overlay(self, addr, n):
+        """ Pick the innermost symbol containing addr among the one found in
+            the index (range number n) and the changed symbols
+        """
+        best = self._index.ranges[n][:2] if n >= 0 else None
+        best_symbol = self._get_symbol(n)
+        for sym, symtab in self._overlay.iteritems():
+            if sym.symtab is not symtab:
+                # Removed from the table
+                continue
+            r = symtab._symbol_address_range(sym, self.types, self.section)
+            if r is None or not r[0] <= addr < r[1]:
+                continue
+            if best is None or (-r[0], r[1]) < (-best[0], best[1]):
+                best = r
+                best_symbol = sym
+        return best_symbol
+
+    def _get_symbol(self, n):
+        """ Get the symbol of range number n
+        """
+        if n < 0:
+            return None
+        owner = self._index.ranges[n][2]
+        symbol = self._symbols.get(owner)
+        if symbol is None:
+            symtab, num = owner
+            symbol = self._symbols[owner] = symtab._range_symbol(num)
+        return symbol